@@ -1,5 +1,103 @@
-from django.contrib import admin
+from django.contrib import admin, messages
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.contrib.admin.views.main import ChangeList, ORDER_VAR, PAGE_VAR
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.functional import cached_property
+from datetime import datetime
+
 from .models import User, Conversation, Participant, Message, FileMessage, DeliveryReceipt
+from .expiry import purge_expired
+
+CURSOR_VAR = 'cursor'
+# Filtered changelists count at most this many rows instead of the whole match,
+# and show a count that reaches it as "10000+"
+COUNT_LIMIT = 10000
+
+
+class EstimatedCountPaginator(Paginator):
+    capped = False
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if not queryset.query.where and connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE relname = %s', [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] > 0:
+                return row[0]
+        count = queryset.order_by()[:COUNT_LIMIT].count()
+        self.capped = count == COUNT_LIMIT
+        return count
+
+
+class KeysetChangeList(ChangeList):
+    # Adds ?cursor=<value>|<pk> so deep pages are reached with an indexed range
+    # scan on (cursor_field, pk) instead of a large OFFSET.
+    def get_filters_params(self, params=None):
+        params = super().get_filters_params(params)
+        params.pop(CURSOR_VAR, None)
+        return params
+
+    def get_results(self, request):
+        super().get_results(request)
+        self.count_capped = self.paginator.capped
+        if self.count_capped:
+            # The search bar would print the capped count as exact; it skips the
+            # count when it equals the full count, and the paginator shows it
+            self.full_result_count = self.result_count
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        cursor = self.params.get(CURSOR_VAR)
+        if not cursor or ORDER_VAR in self.params:
+            return queryset
+
+        field = self.model_admin.cursor_field
+        try:
+            value, pk = cursor.rsplit('|', 1)
+            value = datetime.fromisoformat(value)
+            return queryset.filter(Q(**{f'{field}__lt': value}) | Q(**{field: value, 'pk__lt': pk}))
+        except (ValueError, TypeError) as e:
+            raise IncorrectLookupParameters(e)
+
+
+class ScalableModelAdmin(admin.ModelAdmin):
+    # Sharded models only show the rows on the default database here
+    cursor_field = None
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    change_list_template = 'admin/chat/keyset_change_list.html'
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_actions(self, request):
+        # delete_selected builds a confirmation page of every related row
+        actions = super().get_actions(request)
+        actions.pop('delete_selected', None)
+        return actions
+
+    def changelist_view(self, request, extra_context=None):
+        response = super().changelist_view(request, extra_context)
+        cl = getattr(response, 'context_data', {}).get('cl')
+        if cl is not None and cl.count_capped:
+            # Read by the stock actions bar and the pagination block
+            response.context_data['selection_note_all'] = f'All {cl.result_count}+ selected'
+            response.context_data['module_name'] = f'or more {cl.opts.verbose_name_plural}'
+            response.context_data['page_range'] = cl.paginator.get_elided_page_range(cl.page_num) if cl.multi_page else []
+        if cl is not None and ORDER_VAR not in cl.params:
+            results = list(cl.result_list)
+            if len(results) == cl.list_per_page:
+                last = results[-1]
+                cursor = f"{getattr(last, self.cursor_field).isoformat()}|{last.pk}"
+                response.context_data['next_cursor_url'] = cl.get_query_string({CURSOR_VAR: cursor}, [PAGE_VAR])
+        return response
+
 
 @admin.register(User)
 class UserAdmin(admin.ModelAdmin):
@@ -10,23 +108,75 @@ class UserAdmin(admin.ModelAdmin):
 class ConversationAdmin(admin.ModelAdmin):
     list_display = ('id', 'type', 'created_at')
     list_filter = ('type',)
+    raw_id_fields = ('group_admin',)
 
 @admin.register(Participant)
-class ParticipantAdmin(admin.ModelAdmin):
+class ParticipantAdmin(ScalableModelAdmin):
     list_display = ('user', 'conversation', 'joined_at')
+    list_select_related = ('user', 'conversation')
+    raw_id_fields = ('user', 'conversation')
+    search_fields = ('=user__username',)
+    ordering = ('-joined_at', '-id')
+    cursor_field = 'joined_at'
 
 @admin.register(Message)
-class MessageAdmin(admin.ModelAdmin):
+class MessageAdmin(ScalableModelAdmin):
     list_display = ('sender', 'conversation', 'content_type', 'sent_at')
     list_filter = ('content_type', 'sent_at')
+    list_select_related = ('sender', 'conversation')
+    raw_id_fields = ('sender', 'conversation')
     search_fields = ('sender__username', 'content')
+    search_help_text = 'Exact username, or words in the message (full-text on PostgreSQL)'
+    ordering = ('-sent_at', '-id')
+    cursor_field = 'sent_at'
+    actions = ['purge_expired']
+
+    def get_search_results(self, request, queryset, search_term):
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+
+        if connections[queryset.db].vendor == 'postgresql':
+            # Same expression as the GIN index created in 0006_admin_indexes
+            content_match = Q(pk__in=RawSQL(
+                "SELECT id FROM chat_message WHERE to_tsvector('simple', content) @@ plainto_tsquery('simple', %s)",
+                [search_term]
+            ))
+        else:
+            content_match = Q(content__icontains=search_term)
+        return queryset.filter(Q(sender__username=search_term) | content_match), False
+
+    @admin.action(description='Purge expired messages among the selected, in chunks')
+    def purge_expired(self, request, queryset):
+        deleted = purge_expired(queryset)
+        self.message_user(request, f'Purged {deleted} expired messages.', messages.SUCCESS)
+
+class MimeTypeFilter(admin.SimpleListFilter):
+    # Fixed choices; listing every distinct mime_type would scan the table
+    title = 'mime type'
+    parameter_name = 'mime_type'
+
+    def lookups(self, request, model_admin):
+        return [(kind, kind) for kind in ('image', 'video', 'audio', 'text', 'application')]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(mime_type__startswith=f'{self.value()}/')
+        return queryset
 
 @admin.register(FileMessage)
-class FileMessageAdmin(admin.ModelAdmin):
+class FileMessageAdmin(ScalableModelAdmin):
     list_display = ('id', 'mime_type', 'size_bytes', 'uploaded_at')
-    list_filter = ('mime_type',)
+    list_filter = (MimeTypeFilter,)
+    raw_id_fields = ('message',)
+    ordering = ('-uploaded_at', '-id')
+    cursor_field = 'uploaded_at'
 
 @admin.register(DeliveryReceipt)
-class DeliveryReceiptAdmin(admin.ModelAdmin):
+class DeliveryReceiptAdmin(ScalableModelAdmin):
     list_display = ('message', 'recipient', 'delivered', 'read')
     list_filter = ('delivered', 'read')
+    list_select_related = ('message__sender', 'recipient')
+    raw_id_fields = ('message', 'recipient')
+    ordering = ('-updated_at', '-id')
+    cursor_field = 'updated_at'
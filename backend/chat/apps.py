@@ -0,0 +1,14 @@
+from django.apps import AppConfig
+from django.conf import settings
+import os
+
+
+class ChatConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'chat'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        if settings.FILE_UPLOAD_TEMP_DIR:
+            os.makedirs(settings.FILE_UPLOAD_TEMP_DIR, exist_ok=True)
@@ -0,0 +1,230 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.storage import default_storage
+from django.http import HttpResponseNotAllowed, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+from asgiref.sync import sync_to_async
+from datetime import timedelta
+from functools import wraps
+from types import SimpleNamespace
+import mimetypes
+
+from rest_framework import status
+from rest_framework.exceptions import APIException, Throttled
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .throttling import ActionRateThrottle
+from .models import User, Conversation, Message, FileMessage
+from .routers import shard_for
+from .sharding import conversations_for_user
+from .presence import active_update
+from .membership import conversation_members, cached_user, parse_id, ensure_member, create_receipts
+from .serializers import ConversationSerializer, MessageSerializer
+from .views import ConversationViewSet
+
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+_conversation_detail = ConversationViewSet.as_view({
+    'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'
+})
+
+
+def _render(response, request, renderer, media_type):
+    response.accepted_renderer = renderer
+    response.accepted_media_type = media_type
+    response.renderer_context = {'request': request, 'response': response}
+    return response.render()
+
+
+def async_api_view(methods, basename=None):
+    # The hot endpoints the client calls, as coroutines. They parse, negotiate
+    # and throttle with the same DRF classes as the viewsets (so msgpack works
+    # both ways), but skip APIView's sync dispatch. Authentication and CSRF are
+    # not used by this API. django.views.decorators.csrf.csrf_exempt wraps views
+    # in a sync function on Django 4.2, so the flag is set directly.
+    def decorator(view_func):
+        throttle_view = SimpleNamespace(basename=basename, action=view_func.__name__)
+
+        @wraps(view_func)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+
+            request = Request(request, parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES])
+            renderers = [
+                renderer() for renderer in api_settings.DEFAULT_RENDERER_CLASSES
+                if not issubclass(renderer, BrowsableAPIRenderer)
+            ]
+            try:
+                renderer, media_type = DefaultContentNegotiation().select_renderer(request, renderers)
+            except APIException as exc:
+                renderer, media_type = renderers[0], renderers[0].media_type
+                return _render(Response({'detail': exc.detail}, status=exc.status_code), request, renderer, media_type)
+
+            try:
+                throttle = ActionRateThrottle()
+                if basename and not await sync_to_async(throttle.allow_request)(request, throttle_view):
+                    raise Throttled(throttle.wait())
+                response = await view_func(request, *args, **kwargs)
+            except ValidationError:
+                response = Response({'error': 'Invalid id'}, status=status.HTTP_400_BAD_REQUEST)
+            except Throttled as exc:
+                response = Response({'detail': exc.detail}, status=exc.status_code, headers={'Retry-After': str(exc.wait)})
+            except APIException as exc:
+                response = Response({'detail': exc.detail}, status=exc.status_code)
+
+            if not isinstance(response, Response):
+                return response
+            return _render(response, request, renderer, media_type)
+
+        wrapper.csrf_exempt = True
+        return wrapper
+    return decorator
+
+
+async def _serialize(serializer_class, instance, many=False):
+    return await sync_to_async(lambda: serializer_class(instance, many=many).data)()
+
+
+async def _data(request):
+    # Parsing reads the body, so keep it off the event loop
+    return await sync_to_async(lambda: request.data)()
+
+
+@async_api_view(['POST'], basename='user')
+async def track_activity(request):
+    user_id = (await _data(request)).get('user_id')
+    if not user_id:
+        return Response({'error': 'user_id required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    now = timezone.now()
+    updated = await User.objects.filter(id=user_id).aupdate(**active_update(now))
+    if not updated:
+        return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
+    return Response({'status': 'updated'}, status=status.HTTP_200_OK)
+
+
+@async_api_view(['GET'])
+async def retrieve(request, pk):
+    conversation = await Conversation.objects.using(shard_for(pk)).prefetch_related(
+        'group_admin', 'participant_set__user', 'messages__sender', 'messages__file'
+    ).filter(id=pk).afirst()
+    if conversation is None:
+        return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(await _serialize(ConversationSerializer, conversation))
+
+
+async def conversation_detail(request, pk):
+    # Only reads are hot; edits and deletes keep going through the viewset
+    if request.method == 'GET':
+        return await retrieve(request, pk)
+    return await sync_to_async(_conversation_detail)(request, pk=str(pk))
+
+
+conversation_detail.csrf_exempt = True
+
+
+@async_api_view(['GET'])
+async def messages(request):
+    conversation_id = request.query_params.get('conversation_id')
+    if not conversation_id:
+        return Response({'error': 'conversation_id required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    shard = shard_for(conversation_id)
+    if not await Conversation.objects.using(shard).filter(id=conversation_id).aexists():
+        return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+    queryset = Message.objects.using(shard).filter(
+        conversation_id=conversation_id, expires_at__gt=timezone.now()
+    ).select_related('file').prefetch_related('sender')
+    messages = [message async for message in queryset]
+    return Response(await _serialize(MessageSerializer, messages, many=True))
+
+
+@async_api_view(['GET'])
+async def by_user(request):
+    user_id = request.query_params.get('user_id')
+    if not user_id:
+        return Response({'error': 'user_id required'}, status=status.HTTP_400_BAD_REQUEST)
+
+    if not await User.objects.filter(id=user_id).aexists():
+        return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+    conversations = await sync_to_async(conversations_for_user)(
+        user_id, prefetch=('group_admin', 'participant_set__user', 'messages__sender', 'messages__file')
+    )
+    return Response(await _serialize(ConversationSerializer, conversations, many=True))
+
+
+@async_api_view(['POST'], basename='message')
+async def send(request):
+    data = await _data(request)
+    conversation_id = data.get('conversation_id')
+    sender_id = data.get('sender_id')
+    content = (data.get('content') or '').strip()
+    content_type = data.get('content_type', 'text')
+
+    if not conversation_id or not sender_id or not content:
+        return Response({'error': 'Missing required fields'}, status=status.HTTP_400_BAD_REQUEST)
+
+    # Cached lookups; a cold cache costs one query each
+    members = await sync_to_async(conversation_members)(conversation_id)
+    sender = await sync_to_async(cached_user)(sender_id)
+    if members is None or sender is None:
+        return Response({'error': 'Conversation or user not found'}, status=status.HTTP_404_NOT_FOUND)
+    members = await sync_to_async(ensure_member)(conversation_id, sender, members)
+
+    message = await Message.objects.acreate(
+        conversation_id=parse_id(conversation_id),
+        sender=sender,
+        content=content,
+        content_type=content_type,
+        expires_at=timezone.now() + timedelta(hours=sender.auto_delete_hours)
+    )
+    await sync_to_async(create_receipts)(message, members)
+    # A new message has no file; saves MessageSerializer a lookup
+    Message.file.related.set_cached_value(message, None)
+
+    return Response(await _serialize(MessageSerializer, message), status=status.HTTP_201_CREATED)
+
+
+async def _stream_file(file_obj):
+    read = sync_to_async(file_obj.read, thread_sensitive=False)
+    try:
+        while True:
+            chunk = await read(DOWNLOAD_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        await sync_to_async(file_obj.close, thread_sensitive=False)()
+
+
+@async_api_view(['GET'])
+async def download(request):
+    file_id = request.query_params.get('file_id')
+    file_msg = None
+    for shard in settings.CHAT_SHARDS:
+        file_msg = await FileMessage.objects.using(shard).select_related('message').filter(id=file_id).afirst()
+        if file_msg is not None:
+            break
+    if file_msg is None:
+        return Response({'detail': 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+    if not await sync_to_async(default_storage.exists, thread_sensitive=False)(file_msg.storage_path):
+        return Response({'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    file_obj = await sync_to_async(default_storage.open, thread_sensitive=False)(file_msg.storage_path, 'rb')
+    filename = file_msg.message.content
+    response = StreamingHttpResponse(
+        _stream_file(file_obj),
+        content_type=file_msg.mime_type or mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    )
+    response['Content-Length'] = str(await sync_to_async(default_storage.size, thread_sensitive=False)(file_msg.storage_path))
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    return response
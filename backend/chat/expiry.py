@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.utils import timezone
+from datetime import timedelta
+
+from .models import Message, MessageDeletion, MembershipEvent
+
+PURGE_CHUNK_SIZE = 1000
+
+
+def purge_expired(queryset):
+    # Deletes in chunks so no single delete holds its locks for long. The
+    # delete signals still run: removed files decrement the storage counters
+    # and each message leaves a MessageDeletion tombstone for sync.
+    expired = queryset.filter(expires_at__lte=timezone.now()).order_by()
+    deleted = 0
+    while True:
+        ids = list(expired.values_list('pk', flat=True)[:PURGE_CHUNK_SIZE])
+        if not ids:
+            break
+        Message.objects.using(queryset.db).filter(pk__in=ids).delete()
+        deleted += len(ids)
+    return deleted
+
+
+def prune_sync_history():
+    # Tokens older than SYNC_TOKEN_MAX_AGE get a full resync, so nothing reads
+    # these rows any more; the extra minute covers SYNC_OVERLAP.
+    cutoff = timezone.now() - timedelta(seconds=settings.SYNC_TOKEN_MAX_AGE) - timedelta(minutes=1)
+    pruned = {}
+    for model, field in ((MessageDeletion, 'deleted_at'), (MembershipEvent, 'created_at')):
+        old = model.objects.filter(**{f'{field}__lt': cutoff}).order_by()
+        pruned[model.__name__] = 0
+        while True:
+            ids = list(old.values_list('pk', flat=True)[:PURGE_CHUNK_SIZE])
+            if not ids:
+                break
+            model.objects.filter(pk__in=ids).delete()
+            pruned[model.__name__] += len(ids)
+    return pruned
@@ -0,0 +1,147 @@
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.utils import timezone
+from asgiref.sync import sync_to_async
+import json
+import time
+import zipfile
+
+from .models import User, Participant, Message, FileMessage, DeliveryReceipt
+
+EXPORT_CHUNK_SIZE = 2000
+# Lines are joined into parts of about this size before being sent
+PART_SIZE = 64 * 1024
+
+MESSAGE_FIELDS = ('id', 'sender_id', 'content', 'content_type', 'sent_at', 'edited', 'edited_at', 'expires_at')
+FILE_FIELDS = ('id', 'message_id', 'storage_path', 'mime_type', 'size_bytes', 'hash', 'uploaded_at')
+RECEIPT_FIELDS = ('id', 'message_id', 'recipient_id', 'delivered', 'read', 'delivered_at', 'read_at')
+
+
+class ExportStats:
+    def __init__(self):
+        self.rows = 0
+        self.start = time.perf_counter()
+
+    def summary(self):
+        seconds = time.perf_counter() - self.start
+        return {'rows': self.rows, 'seconds': round(seconds, 3), 'rows_per_second': round(self.rows / seconds) if seconds else None}
+
+
+def _live_messages(conversation, prefix=''):
+    # Expired messages are hidden everywhere else, so they are not exported either
+    now = timezone.now()
+    return Q(**{f'{prefix}conversation_id': conversation.id}) & (
+        Q(**{f'{prefix}expires_at__isnull': True}) | Q(**{f'{prefix}expires_at__gt': now})
+    )
+
+
+def export_rows(conversation, chunk_size=EXPORT_CHUNK_SIZE):
+    # Yields one dict per row. Every query streams through .iterator(), so
+    # memory stays flat however long the history is; only the ids of the
+    # conversation's users are held, to emit each user once.
+    db = conversation._state.db
+    yield {
+        'type': 'conversation', 'id': conversation.id, 'conversation_type': conversation.type,
+        'name': conversation.name, 'description': conversation.description,
+        'group_privacy': conversation.group_privacy, 'group_member_limit': conversation.group_member_limit,
+        'group_admin_id': conversation.group_admin_id, 'created_at': conversation.created_at,
+    }
+
+    user_ids = set()
+    participants = Participant.objects.using(db).filter(conversation=conversation).values('user_id', 'joined_at')
+    for row in participants.iterator(chunk_size=chunk_size):
+        user_ids.add(row['user_id'])
+        yield {'type': 'participant', **row}
+    senders = Message.objects.using(db).filter(_live_messages(conversation)).order_by().values_list('sender_id', flat=True).distinct()
+    user_ids.update(senders.iterator(chunk_size=chunk_size))
+    users = User.objects.filter(id__in=user_ids).values('id', 'username', 'avatar_url')
+    for row in users.iterator(chunk_size=chunk_size):
+        yield {'type': 'user', **row}
+
+    messages = Message.objects.using(db).filter(_live_messages(conversation)).order_by('sent_at', 'id').values(*MESSAGE_FIELDS)
+    for row in messages.iterator(chunk_size=chunk_size):
+        yield {'type': 'message', **row}
+    files = FileMessage.objects.using(db).filter(_live_messages(conversation, 'message__')).values(*FILE_FIELDS)
+    for row in files.iterator(chunk_size=chunk_size):
+        yield {'type': 'file', **row}
+    receipts = DeliveryReceipt.objects.using(db).filter(_live_messages(conversation, 'message__')).values(*RECEIPT_FIELDS)
+    for row in receipts.iterator(chunk_size=chunk_size):
+        yield {'type': 'receipt', **row}
+
+
+def ndjson_parts(conversation, stats, chunk_size=EXPORT_CHUNK_SIZE, summary=True):
+    encoder = DjangoJSONEncoder(ensure_ascii=False)
+    lines = []
+    size = 0
+    for row in export_rows(conversation, chunk_size):
+        stats.rows += 1
+        line = (encoder.encode(row) + '\n').encode()
+        lines.append(line)
+        size += len(line)
+        if size >= PART_SIZE:
+            yield b''.join(lines)
+            lines, size = [], 0
+    if summary:
+        lines.append((json.dumps({'type': 'summary', **stats.summary()}) + '\n').encode())
+    if lines:
+        yield b''.join(lines)
+
+
+class _ZipOutput:
+    # Write-only, unseekable sink for zipfile; the archive is handed out as
+    # it is built
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def zip_parts(conversation, stats, chunk_size=EXPORT_CHUNK_SIZE):
+    # conversation.ndjson plus every referenced file under files/, written
+    # through an unseekable stream so nothing is buffered beyond one part
+    output = _ZipOutput()
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        with archive.open('conversation.ndjson', 'w', force_zip64=True) as entry:
+            for part in ndjson_parts(conversation, stats, chunk_size, summary=False):
+                entry.write(part)
+                if data := output.take():
+                    yield data
+
+        paths = FileMessage.objects.using(conversation._state.db).filter(
+            _live_messages(conversation, 'message__')
+        ).order_by().values_list('storage_path', flat=True).distinct()
+        for path in paths.iterator(chunk_size=chunk_size):
+            if not default_storage.exists(path):
+                continue
+            info = zipfile.ZipInfo(f'files/{path}', date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            with default_storage.open(path, 'rb') as source, archive.open(info, 'w', force_zip64=True) as entry:
+                while chunk := source.read(PART_SIZE):
+                    entry.write(chunk)
+                    if data := output.take():
+                        yield data
+        archive.writestr('summary.json', json.dumps(stats.summary()))
+    yield output.take()
+
+
+async def as_async(parts):
+    # Under ASGI, StreamingHttpResponse would read a sync iterator into a
+    # list first; this hands out one part at a time from the request's thread.
+    next_part = sync_to_async(next, thread_sensitive=True)
+    done = object()
+    try:
+        while (part := await next_part(parts, done)) is not done:
+            yield part
+    finally:
+        await sync_to_async(parts.close, thread_sensitive=True)()
@@ -0,0 +1,213 @@
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from collections import Counter, defaultdict
+from contextlib import ExitStack, contextmanager
+from datetime import timedelta, timezone as dt_timezone
+import uuid
+
+from .models import User, Conversation, Participant, Message, DeliveryReceipt, UserConversation
+from .routers import shard_for
+from .membership import invalidate_conversation
+
+IMPORT_CHUNK_SIZE = 5000
+BATCH_SIZE = 1000
+# Namespace for deriving stable UUIDs from another system's ids, so that
+# re-running an import hits the same rows
+ID_NAMESPACE = uuid.UUID('8f0d6f6e-2a47-4b8e-9c9a-1f4f5e3c2d10')
+REQUIRED_FIELDS = {
+    'user': [('username',)],
+    'participant': [('user_id', 'username')],
+    'message': [('sender_id', 'sender')],
+    'receipt': [('message_id',), ('recipient_id', 'recipient')],
+}
+
+
+@contextmanager
+def original_timestamps(models):
+    # bulk_create would otherwise stamp auto_now/auto_now_add fields with the
+    # time of the copy
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def _uuid(value, kind):
+    if value is None or value == '':
+        return None
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return uuid.uuid5(ID_NAMESPACE, f'{kind}:{value}')
+
+
+def _datetime(value, default):
+    if not value:
+        return default
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise ValueError(f'Invalid datetime: {value}')
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed, dt_timezone.utc)
+
+
+class HistoryImporter:
+    # Reads rows in the export_conversation NDJSON shape:
+    #   {"type": "user", "id", "username", ...}
+    #   {"type": "conversation", "id", "conversation_type", "name", ...}
+    #   {"type": "participant", "conversation_id", "user_id" or "username", ...}
+    #   {"type": "message", "id", "conversation_id", "sender_id" or "sender", "content", "sent_at", ...}
+    #   {"type": "receipt", "message_id", "recipient_id" or "recipient", "delivered", "read", ...}
+    # A missing conversation_id means the last conversation row. Ids that are
+    # not UUIDs are mapped to stable ones. A username that already exists is
+    # merged into the existing user, and rows that are already present
+    # (same id, or the same participant or receipt pair) are skipped.
+    # Rows are buffered and written with bulk_create. Each chunk is checked
+    # before anything is written; users and the directory then commit on
+    # default, followed by the conversation rows on their shards. If a shard
+    # fails after that, re-running the import fills in the missing rows.
+    def __init__(self, chunk_size=IMPORT_CHUNK_SIZE, expire_hours=3):
+        self.chunk_size = chunk_size
+        self.expire_after = timedelta(hours=expire_hours) if expire_hours else None
+        self.now = timezone.now()
+        self.current_conversation = None
+        self.user_ids = {}
+        self.usernames = {}
+        self.buffers = defaultdict(list)
+        self.buffered = 0
+        self.referenced = set()
+        self.counts = Counter()
+
+    def feed(self, row):
+        kind = row.get('type')
+        if kind not in ('user', 'conversation', 'participant', 'message', 'receipt'):
+            self.counts['skipped'] += 1
+            return
+        for keys in REQUIRED_FIELDS.get(kind, ()):
+            if not any(row.get(key) for key in keys):
+                raise ValueError(f'{kind} row needs {" or ".join(keys)}')
+        if kind == 'conversation':
+            self.current_conversation = _uuid(row.get('id'), 'conversation') or uuid.uuid4()
+            row = {**row, 'id': self.current_conversation}
+        elif kind != 'user':
+            row = {**row, 'conversation_id': _uuid(row.get('conversation_id'), 'conversation') or self.current_conversation}
+            if row['conversation_id'] is None:
+                raise ValueError(f'{kind} row before any conversation')
+        self.buffers[kind].append(row)
+        self.counts[kind] += 1
+        self.buffered += 1
+        if self.buffered >= self.chunk_size:
+            self.flush()
+
+    def _user_ref(self, row, id_key, name_key):
+        if row.get(name_key):
+            return self.usernames[row[name_key]]
+        user_id = _uuid(row.get(id_key), 'user')
+        if user_id in self.user_ids:
+            return self.user_ids[user_id]
+        if user_id is not None:
+            self.referenced.add(user_id)
+        return user_id
+
+    def _resolve_users(self):
+        rows = self.buffers.pop('user', [])
+        wanted = {name for kind in ('participant', 'message', 'receipt', 'conversation') for row in self.buffers[kind]
+                  for name in (row.get('username'), row.get('sender'), row.get('recipient'), row.get('group_admin'))
+                  if name and name not in self.usernames}
+        wanted.update(row['username'] for row in rows if row['username'] not in self.usernames)
+        self.usernames.update(User.objects.filter(username__in=wanted).values_list('username', 'id'))
+
+        new_users = []
+        for row in rows:
+            user_id = _uuid(row.get('id'), 'user') or uuid.uuid4()
+            existing = self.usernames.get(row['username'])
+            if existing is not None:
+                self.user_ids[user_id] = existing
+                continue
+            self.usernames[row['username']] = user_id
+            new_users.append(User(
+                id=user_id, username=row['username'], avatar_url=row.get('avatar_url'),
+                created_at=_datetime(row.get('created_at'), self.now), updated_at=self.now,
+                last_activity=_datetime(row.get('last_activity'), self.now), is_online=False,
+                **({'auto_delete_hours': row['auto_delete_hours']} if row.get('auto_delete_hours') else {})
+            ))
+        missing = wanted - set(self.usernames)
+        if missing:
+            raise ValueError(f'Unknown usernames: {", ".join(sorted(missing)[:5])}')
+        return new_users
+
+    def _check_user_ids(self):
+        # Users referenced by id must be in this import or already exist
+        unknown = self.referenced - set(self.usernames.values())
+        if unknown:
+            unknown -= set(User.objects.filter(id__in=unknown).values_list('id', flat=True))
+        if unknown:
+            raise ValueError(f'Unknown user ids: {", ".join(sorted(map(str, unknown))[:5])}')
+        self.referenced.clear()
+
+    def flush(self):
+        if not self.buffered:
+            return
+        new_users = self._resolve_users()
+
+        by_shard = defaultdict(lambda: defaultdict(list))
+        directory = []
+        for row in self.buffers.pop('conversation', []):
+            by_shard[shard_for(row['id'])][Conversation].append(Conversation(
+                id=row['id'], type=row.get('conversation_type') or 'one_to_one',
+                name=row.get('name'), description=row.get('description'),
+                group_privacy=row.get('group_privacy') or 'public',
+                group_member_limit=row.get('group_member_limit') or 50,
+                group_admin_id=self._user_ref(row, 'group_admin_id', 'group_admin'),
+                created_at=_datetime(row.get('created_at'), self.now),
+            ))
+        for row in self.buffers.pop('participant', []):
+            user_id = self._user_ref(row, 'user_id', 'username')
+            by_shard[shard_for(row['conversation_id'])][Participant].append(Participant(
+                conversation_id=row['conversation_id'], user_id=user_id,
+                joined_at=_datetime(row.get('joined_at'), self.now),
+            ))
+            directory.append(UserConversation(user_id=user_id, conversation_id=row['conversation_id']))
+        for row in self.buffers.pop('message', []):
+            sent_at = _datetime(row.get('sent_at'), self.now)
+            expires_at = _datetime(row.get('expires_at'), None)
+            if expires_at is None and self.expire_after:
+                expires_at = self.now + self.expire_after
+            by_shard[shard_for(row['conversation_id'])][Message].append(Message(
+                id=_uuid(row.get('id'), 'message') or uuid.uuid4(), conversation_id=row['conversation_id'],
+                sender_id=self._user_ref(row, 'sender_id', 'sender'), content=row.get('content') or '',
+                content_type=row.get('content_type') or 'text', sent_at=sent_at,
+                edited=bool(row.get('edited')), edited_at=_datetime(row.get('edited_at'), None), expires_at=expires_at,
+            ))
+        for row in self.buffers.pop('receipt', []):
+            by_shard[shard_for(row['conversation_id'])][DeliveryReceipt].append(DeliveryReceipt(
+                message_id=_uuid(row['message_id'], 'message'), recipient_id=self._user_ref(row, 'recipient_id', 'recipient'),
+                delivered=bool(row.get('delivered')), read=bool(row.get('read')),
+                delivered_at=_datetime(row.get('delivered_at'), None), read_at=_datetime(row.get('read_at'), None),
+                updated_at=self.now,
+            ))
+        self._check_user_ids()
+
+        with original_timestamps([User, Conversation, Participant, Message, DeliveryReceipt]):
+            with transaction.atomic():
+                User.objects.bulk_create(new_users, batch_size=BATCH_SIZE, ignore_conflicts=True)
+                UserConversation.objects.bulk_create(directory, batch_size=BATCH_SIZE, ignore_conflicts=True)
+            with ExitStack() as stack:
+                for alias, rows in by_shard.items():
+                    stack.enter_context(transaction.atomic(using=alias))
+                    for model in (Conversation, Participant, Message, DeliveryReceipt):
+                        if rows[model]:
+                            model.objects.using(alias).bulk_create(rows[model], batch_size=BATCH_SIZE, ignore_conflicts=True)
+        # bulk_create sends no signals, so drop cached member sets here
+        for conversation_id in {entry.conversation_id for entry in directory}:
+            invalidate_conversation(conversation_id)
+        self.buffers.clear()
+        self.buffered = 0
@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.text import compress_string
+from rest_framework.renderers import JSONRenderer
+from contextlib import ExitStack
+from datetime import timedelta
+import gzip
+import json
+import time
+import uuid
+
+from chat.models import User, Conversation, Message, Participant, DeliveryReceipt, UserConversation
+from chat.sharding import conversations_for_user
+from chat.renderers import MessagePackRenderer, unpackb
+from chat.serializers import ConversationSerializer
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+class Command(BaseCommand):
+    help = 'Compare payload size and encode/decode CPU time of the JSON and MessagePack formats with each compression'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user-id', help='Benchmark the by_user payload of this user (default: the user in most conversations)')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Benchmark a throwaway conversation set with this many messages, rolled back afterwards')
+        parser.add_argument('--iterations', type=int, default=20)
+
+    def handle(self, *args, **options):
+        with ExitStack() as stack:
+            for alias in settings.CHAT_SHARDS:
+                stack.enter_context(transaction.atomic(using=alias))
+            if options['seed']:
+                user = self._seed(options['seed'])
+            elif options['user_id']:
+                user = User.objects.filter(id=options['user_id']).first()
+            else:
+                user = User.objects.annotate(n=Count('userconversation')).order_by('-n').first()
+            if user is None:
+                raise CommandError('No user to benchmark; pass --user-id or --seed')
+
+            conversations = conversations_for_user(user.id, prefetch=('group_admin', 'participant_set__user', 'messages__sender'))
+            data = ConversationSerializer(conversations, many=True).data
+            for alias in settings.CHAT_SHARDS:
+                transaction.set_rollback(True, using=alias)
+
+        formats = [
+            ('json', lambda d: JSONRenderer().render(d), json.loads),
+            ('msgpack', lambda d: MessagePackRenderer().render(d), unpackb),
+        ]
+        encodings = [('identity', lambda b: b, lambda b: b), ('gzip', compress_string, gzip.decompress)]
+        if brotli is not None:
+            encodings.append(('br', lambda b: brotli.compress(b, quality=5), brotli.decompress))
+
+        iterations = options['iterations']
+        self.stdout.write(f'{"format":<10}{"encoding":<10}{"bytes":>12}{"encode ms":>12}{"decode ms":>12}')
+        for format_name, render, parse in formats:
+            for encoding_name, compress, decompress in encodings:
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    body = compress(render(data))
+                encode_ms = (time.perf_counter() - start) * 1000 / iterations
+
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    parse(decompress(body))
+                decode_ms = (time.perf_counter() - start) * 1000 / iterations
+
+                self.stdout.write(f'{format_name:<10}{encoding_name:<10}{len(body):>12}{encode_ms:>12.2f}{decode_ms:>12.2f}')
+
+    def _seed(self, message_count):
+        suffix = uuid.uuid4().hex[:8]
+        users = [User.objects.create(username=f'bench-{suffix}-{i}') for i in range(10)]
+        conversations = []
+        for i in range(5):
+            conv = Conversation.objects.create(type='group', name=f'bench {i}', group_admin=users[0])
+            Participant.objects.using(conv._state.db).bulk_create([Participant(conversation=conv, user=user) for user in users])
+            UserConversation.objects.bulk_create([UserConversation(user=user, conversation_id=conv.id) for user in users])
+            conversations.append(conv)
+
+        expires_at = timezone.now() + timedelta(hours=3)
+        for c, conv in enumerate(conversations):
+            messages = Message.objects.using(conv._state.db).bulk_create([
+                Message(
+                    conversation=conv,
+                    sender=users[i % len(users)],
+                    content=f'benchmark message number {i} with some ordinary chat text',
+                    expires_at=expires_at
+                )
+                for i in range(c, message_count, len(conversations))
+            ])
+            DeliveryReceipt.objects.using(conv._state.db).bulk_create([
+                DeliveryReceipt(message=message, recipient=users[0]) for message in messages
+            ])
+        return users[0]
@@ -0,0 +1,79 @@
+from django.core.management.base import BaseCommand
+from concurrent.futures import ThreadPoolExecutor
+import json
+import statistics
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+
+class Command(BaseCommand):
+    help = 'Load-test the hot API endpoints on a running server, optionally against a second one'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000/api')
+        parser.add_argument('--compare-url', help='Second server to run the same cases against, e.g. one started under WSGI')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--file-id', help='FileMessage id to include the download endpoints')
+
+    def handle(self, *args, **options):
+        base_url = options['base_url'].rstrip('/')
+        suffix = uuid.uuid4().hex[:8]
+        user = self._call(f'{base_url}/users/login/', {'username': f'bench-a-{suffix}'})
+        other = self._call(f'{base_url}/users/login/', {'username': f'bench-b-{suffix}'})
+        conversation = self._call(f'{base_url}/conversations/get_or_create/', {
+            'user_id': user['id'], 'other_user_id': other['id']
+        })
+
+        send_body = {'conversation_id': conversation['id'], 'sender_id': user['id'], 'content': 'bench'}
+        cases = [
+            ('track_activity', 'users/track_activity/', {'user_id': user['id']}),
+            ('send', 'messages/send/', send_body),
+            ('messages', f'conversations/messages/?conversation_id={conversation["id"]}', None),
+            ('by_user', f'conversations/by_user/?user_id={user["id"]}', None),
+            ('retrieve', f'conversations/{conversation["id"]}/', None),
+        ]
+        if options['file_id']:
+            cases.append(('download', f'files/download/?file_id={options["file_id"]}', None))
+
+        # Both servers must share a database, so the same ids work on either
+        servers = [('base', base_url)]
+        if options['compare_url']:
+            servers.append(('compare', options['compare_url'].rstrip('/')))
+
+        self.stdout.write(f'{"endpoint":<16}{"server":<9}{"req/s":>9}{"p50 ms":>9}{"p99 ms":>9}{"errors":>8}')
+        for name, path, body in cases:
+            for server, url in servers:
+                rate, p50, p99, errors = self._run(f'{url}/{path}', body, options['requests'], options['concurrency'])
+                self.stdout.write(f'{name:<16}{server:<9}{rate:>9.1f}{p50:>9.1f}{p99:>9.1f}{errors:>8}')
+
+    def _call(self, url, body=None):
+        data = json.dumps(body).encode() if body is not None else None
+        request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return json.loads(response.read() or b'null')
+
+    def _timed_call(self, url, body):
+        start = time.perf_counter()
+        try:
+            data = json.dumps(body).encode() if body is not None else None
+            request = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+            with urllib.request.urlopen(request, timeout=30) as response:
+                response.read()
+            ok = True
+        except (urllib.error.URLError, OSError):
+            ok = False
+        return time.perf_counter() - start, ok
+
+    def _run(self, url, body, total, concurrency):
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda _: self._timed_call(url, body), range(total)))
+        elapsed = time.perf_counter() - start
+
+        latencies = sorted(latency * 1000 for latency, _ in results)
+        errors = sum(1 for _, ok in results if not ok)
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        return total / elapsed, statistics.median(latencies), p99, errors
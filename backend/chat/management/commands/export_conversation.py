@@ -0,0 +1,41 @@
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+import sys
+
+from chat.export import EXPORT_CHUNK_SIZE, ExportStats, ndjson_parts, zip_parts
+from chat.models import Conversation
+from chat.routers import shard_for
+
+
+class Command(BaseCommand):
+    help = "Stream a conversation's messages, files and receipts as NDJSON, or as a zip with the files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('conversation_id')
+        parser.add_argument('--output', '-o', default='-', help='File to write, or - for stdout (default)')
+        parser.add_argument('--files', action='store_true', help='Write a zip archive that includes the uploaded files')
+        parser.add_argument('--chunk-size', type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        conversation_id = options['conversation_id']
+        try:
+            conversation = Conversation.objects.using(shard_for(conversation_id)).filter(id=conversation_id).first()
+        except ValidationError:
+            conversation = None
+        if conversation is None:
+            raise CommandError(f'Conversation not found: {conversation_id}')
+        if options['files'] and options['output'] == '-':
+            raise CommandError('--files writes a zip archive; pass --output')
+
+        stats = ExportStats()
+        parts = (zip_parts if options['files'] else ndjson_parts)(conversation, stats, options['chunk_size'])
+        output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        try:
+            for part in parts:
+                output.write(part)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+
+        summary = stats.summary()
+        self.stderr.write(f"Exported {summary['rows']} rows in {summary['seconds']:.2f}s ({summary['rows_per_second']} rows/s)")
@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+import json
+import sys
+import time
+
+from chat.importer import IMPORT_CHUNK_SIZE, HistoryImporter
+
+
+class Command(BaseCommand):
+    help = 'Bulk import users, conversations, participants, messages and receipts from NDJSON (the export_conversation format)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', nargs='?', default='-', help='NDJSON file, or - for stdin (default)')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help='Rows per transaction')
+        parser.add_argument('--expire-hours', type=int, default=3,
+                            help='Expiry for messages without expires_at, from now; 0 keeps them forever')
+
+    def handle(self, *args, **options):
+        importer = HistoryImporter(chunk_size=options['chunk_size'], expire_hours=options['expire_hours'])
+        source = sys.stdin if options['input'] == '-' else open(options['input'], encoding='utf-8')
+        start = time.perf_counter()
+        try:
+            for line_number, line in enumerate(source, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    importer.feed(json.loads(line))
+                except (ValueError, IntegrityError) as e:
+                    raise CommandError(f'Line {line_number}: {e}')
+            try:
+                importer.flush()
+            except (ValueError, IntegrityError) as e:
+                raise CommandError(str(e))
+        finally:
+            if source is not sys.stdin:
+                source.close()
+
+        seconds = time.perf_counter() - start
+        counts = importer.counts
+        self.stdout.write(', '.join(f'{counts[kind]} {kind}s' for kind in ('user', 'conversation', 'participant', 'message', 'receipt')))
+        if counts['skipped']:
+            self.stdout.write(f"{counts['skipped']} rows of other types skipped")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported in {seconds:.1f}s ({counts['message'] / seconds * 60:,.0f} messages/min)"
+        ))
@@ -0,0 +1,103 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from collections import defaultdict
+import json
+import os
+import subprocess
+import sys
+
+# Runs in a fresh interpreter under -X importtime: load config.asgi, the
+# application uvicorn workers serve, warm it up and drive one request through
+# it, reporting the time of each step.
+STARTUP_SCRIPT = '''
+import asyncio, json, os, time
+start = time.perf_counter()
+from config.asgi import application
+import config.urls
+loaded = time.perf_counter()
+from chat.warmup import warm_up
+if os.environ.get('PROFILE_STARTUP_WARM_UP') == '1':
+    warm_up()
+warmed = time.perf_counter()
+scope = {
+    'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+    'path': os.environ['PROFILE_STARTUP_PATH'], 'raw_path': os.environ['PROFILE_STARTUP_PATH'].encode(),
+    'query_string': b'', 'root_path': '', 'headers': [(b'host', b'localhost')],
+    'client': ('127.0.0.1', 0), 'server': ('localhost', 80),
+}
+statuses = []
+
+async def receive():
+    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+async def send(message):
+    if message['type'] == 'http.response.start':
+        statuses.append(message['status'])
+
+asyncio.run(application(scope, receive, send))
+responded = time.perf_counter()
+print(json.dumps({
+    'status': statuses[0] if statuses else None,
+    'load_ms': (loaded - start) * 1000,
+    'warm_up_ms': (warmed - loaded) * 1000,
+    'first_response_ms': (responded - warmed) * 1000,
+    'total_ms': (responded - start) * 1000,
+}))
+'''
+
+
+class Command(BaseCommand):
+    help = 'Report per-module import time and time to first response of a fresh web process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', default='/api/', help='Path of the first request')
+        parser.add_argument('--top', type=int, default=25, help='Number of slowest modules to list')
+        parser.add_argument('--no-warm-up', action='store_true', help='Skip chat.warmup before the first request')
+        parser.add_argument('--budget-ms', type=float,
+                            help='Fail if loading plus the first response takes longer than this')
+
+    def handle(self, *args, **options):
+        env = dict(os.environ, PROFILE_STARTUP_PATH=options['path'],
+                   PROFILE_STARTUP_WARM_UP='0' if options['no_warm_up'] else '1')
+        result = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            raise CommandError(f'Startup failed:\n{result.stderr[-4000:]}')
+
+        modules = []
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:') or 'self [us]' in line:
+                continue
+            own, cumulative, name = line[len('import time:'):].split('|')
+            modules.append((name.strip(), int(own), int(cumulative)))
+
+        packages = defaultdict(int)
+        for name, own, _ in modules:
+            packages[name.split('.')[0]] += own
+
+        self.stdout.write(f'{"self ms":>9}{"cumul ms":>10}  module')
+        for name, own, cumulative in sorted(modules, key=lambda m: m[1], reverse=True)[:options['top']]:
+            self.stdout.write(f'{own / 1000:>9.1f}{cumulative / 1000:>10.1f}  {name}')
+
+        self.stdout.write(f'\n{"self ms":>9}  package')
+        for name, own in sorted(packages.items(), key=lambda p: p[1], reverse=True)[:options['top']]:
+            self.stdout.write(f'{own / 1000:>9.1f}  {name}')
+
+        # importtime's own bookkeeping slows imports a little, so these are upper bounds
+        timings = json.loads(result.stdout.strip().splitlines()[-1])
+        self.stdout.write(
+            f"\nload {timings['load_ms']:.1f} ms, warm-up {timings['warm_up_ms']:.1f} ms, "
+            f"first response {timings['first_response_ms']:.1f} ms ({timings['status']}), "
+            f"total {timings['total_ms']:.1f} ms"
+        )
+
+        if not timings['status'] or not 200 <= timings['status'] < 300:
+            raise CommandError(f"First response to {options['path']} returned {timings['status']}")
+
+        budget = options['budget_ms']
+        if budget is not None:
+            if timings['total_ms'] > budget:
+                raise CommandError(f"Time to first response {timings['total_ms']:.1f} ms exceeds the {budget:.0f} ms budget")
+            self.stdout.write(self.style.SUCCESS(f'Within the {budget:.0f} ms budget'))
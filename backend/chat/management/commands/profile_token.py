@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+
+from chat.profiling import make_token
+
+
+class Command(BaseCommand):
+    help = 'Print an X-Profile header value that turns on profiling for the requests carrying it'
+
+    def handle(self, *args, **options):
+        self.stdout.write(make_token())
@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from chat.expiry import purge_expired, prune_sync_history
+from chat.models import Message
+
+
+class Command(BaseCommand):
+    help = 'Delete expired messages and their file records on every shard, and sync history past SYNC_TOKEN_MAX_AGE'
+
+    def handle(self, *args, **options):
+        for alias in settings.CHAT_SHARDS:
+            deleted = purge_expired(Message.objects.using(alias).all())
+            self.stdout.write(f'Purged {deleted} expired messages on {alias}')
+
+        for name, pruned in prune_sync_history().items():
+            self.stdout.write(f'Pruned {pruned} {name} rows')
@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from collections import Counter
+import time
+
+from chat.models import Conversation, ConversationStorageUsage, Participant, Message, FileMessage, DeliveryReceipt
+from chat.importer import original_timestamps
+from chat.routers import shard_for
+from chat.signals import tracking_suppressed
+
+# Copied in this order so foreign keys resolve on the target, keyed by the
+# lookup that selects one conversation's rows.
+CONVERSATION_ROWS = [
+    (Conversation, 'pk'),
+    (ConversationStorageUsage, 'conversation_id'),
+    (Participant, 'conversation_id'),
+    (Message, 'conversation_id'),
+    (FileMessage, 'message__conversation_id'),
+    (DeliveryReceipt, 'message__conversation_id'),
+]
+
+
+class Command(BaseCommand):
+    help = 'Move each conversation and its rows to the shard its id hashes to, after adding shards'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--migrate', action='store_true', help='Run migrate on every shard database first')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many conversations would move')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options['migrate']:
+            for alias in settings.CHAT_SHARDS:
+                call_command('migrate', database=alias, verbosity=0)
+                self.stdout.write(f'Migrated {alias}')
+
+        moves = Counter()
+        start = time.perf_counter()
+        for source in settings.CHAT_SHARDS:
+            conversation_ids = list(Conversation.objects.using(source).values_list('id', flat=True))
+            for conversation_id in conversation_ids:
+                target = shard_for(conversation_id)
+                if target == source:
+                    continue
+                if not options['dry_run']:
+                    self._move(conversation_id, source, target, options['batch_size'])
+                moves[source, target] += 1
+
+        for (source, target), count in sorted(moves.items()):
+            self.stdout.write(f'{source} -> {target}: {count} conversations')
+        verb = 'Would move' if options['dry_run'] else 'Moved'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {sum(moves.values())} conversations in {time.perf_counter() - start:.1f}s'
+        ))
+
+    def _move(self, conversation_id, source, target, batch_size):
+        # The target commits before the source delete; if the delete then fails
+        # the conversation stays on the source and the next run replaces the
+        # partial copy.
+        with tracking_suppressed(), original_timestamps([model for model, _ in CONVERSATION_ROWS]), \
+                transaction.atomic(using=source), transaction.atomic(using=target):
+            Conversation.objects.using(target).filter(pk=conversation_id).delete()
+            for model, lookup in CONVERSATION_ROWS:
+                rows = model.objects.using(source).filter(**{lookup: conversation_id}).order_by().iterator(chunk_size=batch_size)
+                batch = []
+                for row in rows:
+                    batch.append(row)
+                    if len(batch) == batch_size:
+                        model.objects.using(target).bulk_create(batch)
+                        batch = []
+                if batch:
+                    model.objects.using(target).bulk_create(batch)
+            Conversation.objects.using(source).filter(pk=conversation_id).delete()
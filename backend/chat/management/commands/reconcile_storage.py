@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+from collections import Counter
+
+from chat.models import FileMessage, UserStorageUsage, ConversationStorageUsage
+
+
+class Command(BaseCommand):
+    help = 'Recompute per-user and per-conversation storage counters from FileMessage'
+
+    def handle(self, *args, **options):
+        user_bytes, user_files = Counter(), Counter()
+        for alias in settings.CHAT_SHARDS:
+            # Conversation counters live on the conversation's shard; a user's
+            # files can be on any shard, so their totals are summed up first.
+            with transaction.atomic(using=alias):
+                totals = FileMessage.objects.using(alias).order_by().values('message__conversation_id').annotate(
+                    total_bytes=Sum('size_bytes'), total_files=Count('id')
+                )
+                ConversationStorageUsage.objects.using(alias).all().delete()
+                rows = ConversationStorageUsage.objects.using(alias).bulk_create([
+                    ConversationStorageUsage(
+                        conversation_id=row['message__conversation_id'], bytes_used=row['total_bytes'], file_count=row['total_files']
+                    )
+                    for row in totals.iterator(chunk_size=2000)
+                ], batch_size=1000)
+            self.stdout.write(f'ConversationStorageUsage on {alias}: {len(rows)} rows')
+
+            totals = FileMessage.objects.using(alias).order_by().values('message__sender_id').annotate(
+                total_bytes=Sum('size_bytes'), total_files=Count('id')
+            )
+            for row in totals.iterator(chunk_size=2000):
+                user_bytes[row['message__sender_id']] += row['total_bytes']
+                user_files[row['message__sender_id']] += row['total_files']
+
+        with transaction.atomic():
+            UserStorageUsage.objects.all().delete()
+            rows = UserStorageUsage.objects.bulk_create([
+                UserStorageUsage(user_id=user_id, bytes_used=user_bytes[user_id], file_count=user_files[user_id])
+                for user_id in user_bytes
+            ], batch_size=1000)
+        self.stdout.write(f'UserStorageUsage: {len(rows)} rows')
@@ -0,0 +1,142 @@
+from django.conf import settings
+from django.core.cache import cache
+from collections import OrderedDict
+import threading
+import time
+import uuid
+
+from .models import User, Conversation, Participant, DeliveryReceipt
+from .routers import shard_for
+
+USER_FIELDS = ('id', 'username', 'avatar_url', 'created_at', 'updated_at', 'auto_delete_hours', 'last_activity', 'is_online')
+# Saves touching only these leave the cached sender alone; the cached
+# last_activity may lag by up to MEMBERSHIP_CACHE_TIMEOUT.
+PRESENCE_FIELDS = {'last_activity', 'is_online', 'updated_at'}
+
+
+class _LocalCache:
+    # Per-process layer in front of the shared cache. Entries live for
+    # MEMBERSHIP_CACHE_LOCAL_TTL seconds, which bounds how long another
+    # worker's invalidation can go unseen here.
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + settings.MEMBERSHIP_CACHE_LOCAL_TTL, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_cache = _LocalCache()
+
+
+def parse_id(value):
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        return None
+
+
+def _get(key, load):
+    value = local_cache.get(key)
+    if value is not None:
+        return value
+    shared = settings.MEMBERSHIP_CACHE_SHARED
+    value = cache.get(key) if shared else None
+    if value is None:
+        value = load()
+        if value is None:
+            return None
+        if shared:
+            cache.set(key, value, settings.MEMBERSHIP_CACHE_TIMEOUT)
+    local_cache.set(key, value)
+    return value
+
+
+def _load_members(conversation_id):
+    # One query: no rows if the conversation is missing, one (None,) row if it
+    # has no participants
+    rows = list(Conversation.objects.using(shard_for(conversation_id)).filter(
+        id=conversation_id
+    ).values_list('participant__user_id', flat=True))
+    if not rows:
+        return None
+    return frozenset(user_id for user_id in rows if user_id is not None)
+
+
+def conversation_members(conversation_id, refresh=False):
+    # The user ids in the conversation, or None if it does not exist
+    conversation_id = parse_id(conversation_id)
+    if conversation_id is None:
+        return None
+    key = f'membership:conversation:{conversation_id}'
+    if refresh:
+        invalidate_conversation(conversation_id)
+    return _get(key, lambda: _load_members(conversation_id))
+
+
+def cached_user(user_id):
+    # A User built from cached fields, for reading sender metadata and as a
+    # foreign key target. It may be slightly stale, so it is never saved.
+    user_id = parse_id(user_id)
+    if user_id is None:
+        return None
+    fields = _get(f'membership:user:{user_id}', lambda: User.objects.filter(id=user_id).values(*USER_FIELDS).first())
+    if fields is None:
+        return None
+    return User.from_db('default', USER_FIELDS, [fields[name] for name in USER_FIELDS])
+
+
+def _delete(key):
+    local_cache.delete(key)
+    if settings.MEMBERSHIP_CACHE_SHARED:
+        cache.delete(key)
+
+
+def invalidate_conversation(conversation_id):
+    _delete(f'membership:conversation:{parse_id(conversation_id)}')
+
+
+def invalidate_user(user_id):
+    _delete(f'membership:user:{parse_id(user_id)}')
+
+
+def ensure_member(conversation_id, user, members):
+    # Senders who are not members yet are added, as before. A miss may be a
+    # stale copy, so the database is asked before inserting.
+    if user.id in members:
+        return members
+    members = conversation_members(conversation_id, refresh=True) or frozenset()
+    if user.id not in members:
+        Participant.objects.create(conversation_id=parse_id(conversation_id), user=user)
+        members = members | {user.id}
+    return members
+
+
+def create_receipts(message, members):
+    DeliveryReceipt.objects.using(message._state.db).bulk_create([
+        DeliveryReceipt(message=message, recipient_id=user_id) for user_id in members if user_id != message.sender_id
+    ])
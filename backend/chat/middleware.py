@@ -0,0 +1,166 @@
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_string
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+
+import random
+import threading
+import time
+
+from .throttling import count
+from .profiling import StackSampler, save_profile, valid_token
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+def _accepted_encodings(header):
+    accepted = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        q = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        if q > 0:
+            accepted.add(coding.strip().lower())
+    return accepted
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    # Streaming responses (file downloads) are passed through untouched.
+    def process_response(self, request, response):
+        if response.streaming or response.has_header('Content-Encoding'):
+            return response
+        if len(response.content) < getattr(settings, 'COMPRESSION_MIN_SIZE', 1024):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        accepted = _accepted_encodings(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+        if brotli is not None and 'br' in accepted:
+            encoding = 'br'
+            compressed = brotli.compress(response.content, quality=getattr(settings, 'BROTLI_QUALITY', 5))
+        elif 'gzip' in accepted:
+            encoding = 'gzip'
+            compressed = compress_string(response.content)
+        else:
+            return response
+
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+
+class AdmissionControlMiddleware(MiddlewareMixin):
+    # Caps in-flight API requests per worker process and sheds the rest with
+    # 429 before they queue up on the database.
+    lock = threading.Lock()
+    in_flight = 0
+
+    def process_request(self, request):
+        limit = getattr(settings, 'MAX_CONCURRENT_REQUESTS_PER_WORKER', 0)
+        if not limit or not request.path.startswith('/api/'):
+            return None
+
+        cls = type(self)
+        with cls.lock:
+            if cls.in_flight >= limit:
+                shed = True
+            else:
+                shed = False
+                cls.in_flight += 1
+        if shed:
+            count('shed')
+            response = JsonResponse({'error': 'Server busy, retry shortly'}, status=429)
+            response['Retry-After'] = '1'
+            return response
+
+        request._admitted = True
+        return None
+
+    def process_response(self, request, response):
+        if getattr(request, '_admitted', False):
+            cls = type(self)
+            with cls.lock:
+                cls.in_flight -= 1
+        return response
+
+
+class ProfilingMiddleware:
+    # Samples the view's call stack when the request carries a valid X-Profile
+    # token (see the profile_token command) or is picked by PROFILE_SAMPLE_RATE.
+    # Other requests pay for one header lookup.
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def _sampler(self, request):
+        if valid_token(request.headers.get('X-Profile')):
+            trigger = 'header'
+        elif settings.PROFILE_SAMPLE_RATE and random.random() < settings.PROFILE_SAMPLE_RATE:
+            trigger = 'sample'
+        else:
+            return None
+        request._profile_trigger = trigger
+        request._profile_start = time.perf_counter()
+        return StackSampler(settings.PROFILE_INTERVAL_MS / 1000)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # Runs on the thread that will run a sync view; async views run on the
+        # event loop thread, recorded in __acall__.
+        sampler = getattr(request, '_profiler', None)
+        if sampler is not None:
+            loop_thread = getattr(request, '_profile_loop_thread', None)
+            sampler.start(loop_thread if loop_thread and iscoroutinefunction(view_func) else threading.get_ident())
+            request._profile_view = request.resolver_match.view_name
+        return None
+
+    def _finish(self, request, response):
+        samples = request._profiler.stop()
+        profile_id = save_profile(
+            samples,
+            method=request.method,
+            path=request.path,
+            view=getattr(request, '_profile_view', None),
+            status=response.status_code,
+            duration_ms=round((time.perf_counter() - request._profile_start) * 1000, 1),
+            trigger=request._profile_trigger,
+        )
+        response['X-Profile-Id'] = profile_id
+        return response
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        request._profiler = self._sampler(request)
+        response = self.get_response(request)
+        if request._profiler is None:
+            return response
+        return self._finish(request, response)
+
+    async def __acall__(self, request):
+        request._profiler = self._sampler(request)
+        request._profile_loop_thread = threading.get_ident()
+        response = await self.get_response(request)
+        if request._profiler is None:
+            return response
+        return await sync_to_async(self._finish, thread_sensitive=False)(request, response)
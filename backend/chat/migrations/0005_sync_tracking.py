@@ -0,0 +1,38 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:46
+
+from django.db import migrations, models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0004_user_is_online_user_last_activity'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MembershipEvent',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('conversation_id', models.UUIDField(db_index=True)),
+                ('user_id', models.UUIDField()),
+                ('action', models.CharField(choices=[('joined', 'Joined'), ('left', 'Left')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='deliveryreceipt',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['conversation', 'sent_at'], name='chat_messag_convers_a33ce9_idx'),
+        ),
+    ]
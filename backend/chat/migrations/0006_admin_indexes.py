@@ -0,0 +1,47 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:51
+
+from django.db import migrations, models
+
+
+def create_content_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(
+            "CREATE INDEX IF NOT EXISTS chat_message_content_fts ON chat_message "
+            "USING gin (to_tsvector('simple', content))"
+        )
+
+
+def drop_content_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS chat_message_content_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0005_sync_tracking'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='filemessage',
+            name='uploaded_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='sent_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='participant',
+            name='joined_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.RunPython(create_content_search_index, drop_content_search_index),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:52
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_usage(apps, schema_editor):
+    FileMessage = apps.get_model('chat', 'FileMessage')
+    for model_name, key_field, group_by in (
+        ('UserStorageUsage', 'user_id', 'message__sender_id'),
+        ('ConversationStorageUsage', 'conversation_id', 'message__conversation_id'),
+    ):
+        model = apps.get_model('chat', model_name)
+        totals = FileMessage.objects.order_by().values(group_by).annotate(
+            total_bytes=models.Sum('size_bytes'), total_files=models.Count('id')
+        )
+        model.objects.bulk_create([
+            model(**{key_field: row[group_by], 'bytes_used': row['total_bytes'], 'file_count': row['total_files']})
+            for row in totals
+        ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_admin_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationStorageUsage',
+            fields=[
+                ('conversation', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='storage_usage', serialize=False, to='chat.conversation')),
+                ('bytes_used', models.BigIntegerField(default=0)),
+                ('file_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='UserStorageUsage',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='storage_usage', serialize=False, to='chat.user')),
+                ('bytes_used', models.BigIntegerField(default=0)),
+                ('file_count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='filemessage',
+            name='hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.RunPython(populate_usage, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 4.2.7 on 2026-10-19 04:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+def populate_directory(apps, schema_editor):
+    # Runs on the default database only, which holds every conversation until
+    # rebalance_shards spreads them out.
+    Participant = apps.get_model('chat', 'Participant')
+    UserConversation = apps.get_model('chat', 'UserConversation')
+    rows = Participant.objects.order_by().values_list('user_id', 'conversation_id').iterator(chunk_size=2000)
+    UserConversation.objects.bulk_create(
+        (UserConversation(user_id=user_id, conversation_id=conversation_id) for user_id, conversation_id in rows),
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_storage_usage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='conversation',
+            name='group_admin',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='admin_of', to='chat.user'),
+        ),
+        migrations.AlterField(
+            model_name='deliveryreceipt',
+            name='recipient',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='chat.user'),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='sender',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='chat.user'),
+        ),
+        migrations.AlterField(
+            model_name='participant',
+            name='user',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, to='chat.user'),
+        ),
+        migrations.CreateModel(
+            name='UserConversation',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('conversation_id', models.UUIDField()),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='chat.user')),
+            ],
+            options={
+                'unique_together': {('user', 'conversation_id')},
+            },
+        ),
+        migrations.RunPython(populate_directory, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-19 05:23
+
+from django.db import migrations, models
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_sharding'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageDeletion',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('message_id', models.UUIDField()),
+                ('conversation_id', models.UUIDField(db_index=True)),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='last_activity',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -2,14 +2,27 @@ from django.db import models
 from django.utils import timezone
 import uuid
 
+
+class ShardRoutedQuerySet(models.QuerySet):
+    # QuerySet.create() saves to the queryset's database, which has no row to
+    # route by; let chat.routers.ShardRouter place the new row by its
+    # conversation instead.
+    def create(self, **kwargs):
+        if self._db is not None:
+            return super().create(**kwargs)
+        obj = self.model(**kwargs)
+        obj.save(force_insert=True)
+        return obj
+
+
 class User(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     username = models.CharField(max_length=150, unique=True)
     avatar_url = models.CharField(max_length=500, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
     auto_delete_hours = models.IntegerField(default=3)
-    last_activity = models.DateTimeField(default=timezone.now)
+    last_activity = models.DateTimeField(default=timezone.now, db_index=True)
     is_online = models.BooleanField(default=True)
 
     def __str__(self):
@@ -36,10 +49,14 @@ class Conversation(models.Model):
     description = models.TextField(blank=True, null=True)
     group_privacy = models.CharField(max_length=20, choices=GROUP_PRIVACY_CHOICES, default='public', blank=True, null=True)
     group_member_limit = models.IntegerField(default=50, blank=True, null=True)
-    group_admin = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='admin_of')
+    # Users live on the default database while conversations are sharded, so
+    # foreign keys to User carry no database constraint.
+    group_admin = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='admin_of', db_constraint=False)
     participants = models.ManyToManyField(User, through='Participant')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = ShardRoutedQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.name or self.id}"
 
@@ -47,8 +64,10 @@ class Conversation(models.Model):
 class Participant(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE)
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    joined_at = models.DateTimeField(auto_now_add=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
+    joined_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = ShardRoutedQuerySet.as_manager()
 
     class Meta:
         unique_together = ('conversation', 'user')
@@ -66,16 +85,19 @@ class Message(models.Model):
     ]
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     conversation = models.ForeignKey(Conversation, on_delete=models.CASCADE, related_name='messages')
-    sender = models.ForeignKey(User, on_delete=models.CASCADE)
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
     content = models.TextField()
     content_type = models.CharField(max_length=20, choices=CONTENT_TYPE_CHOICES, default='text')
-    sent_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(auto_now_add=True, db_index=True)
     edited = models.BooleanField(default=False)
     edited_at = models.DateTimeField(null=True, blank=True)
-    expires_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    objects = ShardRoutedQuerySet.as_manager()
 
     class Meta:
         ordering = ['sent_at']
+        indexes = [models.Index(fields=['conversation', 'sent_at'])]
 
     def __str__(self):
         return f"Message from {self.sender.username} at {self.sent_at}"
@@ -87,24 +109,90 @@ class FileMessage(models.Model):
     storage_path = models.CharField(max_length=500)
     mime_type = models.CharField(max_length=100)
     size_bytes = models.BigIntegerField()
-    hash = models.CharField(max_length=64, blank=True, null=True)
-    uploaded_at = models.DateTimeField(auto_now_add=True)
+    hash = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+    uploaded_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = ShardRoutedQuerySet.as_manager()
 
     def __str__(self):
         return f"File {self.id}"
 
 
+class UserStorageUsage(models.Model):
+    # Running totals of FileMessage.size_bytes, maintained by chat.storage_usage
+    user = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='storage_usage')
+    bytes_used = models.BigIntegerField(default=0)
+    file_count = models.IntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.user_id}: {self.bytes_used} bytes in {self.file_count} files"
+
+
+class ConversationStorageUsage(models.Model):
+    conversation = models.OneToOneField(Conversation, on_delete=models.CASCADE, primary_key=True, related_name='storage_usage')
+    bytes_used = models.BigIntegerField(default=0)
+    file_count = models.IntegerField(default=0)
+
+    objects = ShardRoutedQuerySet.as_manager()
+
+    def __str__(self):
+        return f"{self.conversation_id}: {self.bytes_used} bytes in {self.file_count} files"
+
+
 class DeliveryReceipt(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     message = models.ForeignKey(Message, on_delete=models.CASCADE, related_name='receipts')
-    recipient = models.ForeignKey(User, on_delete=models.CASCADE)
+    recipient = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
     delivered = models.BooleanField(default=False)
     read = models.BooleanField(default=False)
     delivered_at = models.DateTimeField(null=True, blank=True)
     read_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = ShardRoutedQuerySet.as_manager()
 
     class Meta:
         unique_together = ('message', 'recipient')
 
     def __str__(self):
         return f"Receipt for message {self.message.id} to {self.recipient.username}"
+
+
+class UserConversation(models.Model):
+    # Which conversations each user is in, kept on the default database next to
+    # users so per-user lookups don't have to visit every shard. Mirrors
+    # Participant via chat.signals.
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    conversation_id = models.UUIDField()
+
+    class Meta:
+        unique_together = ('user', 'conversation_id')
+
+    def __str__(self):
+        return f"{self.user_id} in {self.conversation_id}"
+
+
+class MembershipEvent(models.Model):
+    ACTION_CHOICES = [('joined', 'Joined'), ('left', 'Left')]
+    # Plain UUIDs rather than foreign keys so that "left" events survive the
+    # participant, user or conversation being deleted.
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    conversation_id = models.UUIDField(db_index=True)
+    user_id = models.UUIDField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.user_id} {self.action} {self.conversation_id}"
+
+
+class MessageDeletion(models.Model):
+    # Tombstones for sync, so clients drop messages deleted since their token
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    message_id = models.UUIDField()
+    conversation_id = models.UUIDField(db_index=True)
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.message_id} deleted from {self.conversation_id}"
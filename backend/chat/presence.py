@@ -0,0 +1,34 @@
+from django.db.models import Case, F, Q, Value, When
+
+from datetime import timedelta
+
+# Users count as online while their last activity is this recent
+ONLINE_WINDOW = timedelta(minutes=30)
+
+
+def _came_online(now):
+    return Q(is_online=False) | Q(last_activity__lte=now - ONLINE_WINDOW)
+
+
+def mark_active(user, now):
+    # updated_at drives sync's presence deltas, so it only moves when the user
+    # comes back online, not on every ping
+    was_online = user.is_online and user.last_activity > now - ONLINE_WINDOW
+    user.last_activity = now
+    user.is_online = True
+    user.save(update_fields=['last_activity', 'is_online'] if was_online else ['last_activity', 'is_online', 'updated_at'])
+
+
+def active_update(now):
+    # mark_active as keyword arguments for QuerySet.update()
+    return {
+        'last_activity': now,
+        'is_online': True,
+        'updated_at': Case(When(_came_online(now), then=Value(now)), default=F('updated_at')),
+    }
+
+
+def presence_changes(since, now):
+    # Users who came online or logged out since the token, plus those whose
+    # activity went stale in between, which nothing else would report
+    return Q(updated_at__gt=since) | Q(last_activity__gt=since - ONLINE_WINDOW, last_activity__lte=now - ONLINE_WINDOW)
@@ -0,0 +1,124 @@
+from django.conf import settings
+from django.core import signing
+from collections import Counter
+from datetime import datetime, timezone
+import json
+import os
+import re
+import secrets
+import sys
+import threading
+import time
+
+TOKEN_SALT = 'chat.profile'
+PROFILE_ID_RE = re.compile(r'^\d+-[0-9a-f]{8}$')
+
+
+def make_token():
+    return signing.TimestampSigner(salt=TOKEN_SALT).sign('profile')
+
+
+def valid_token(token):
+    if not token:
+        return False
+    try:
+        signing.TimestampSigner(salt=TOKEN_SALT).unsign(token, max_age=settings.PROFILE_TOKEN_MAX_AGE)
+    except signing.BadSignature:
+        return False
+    return True
+
+
+def _frame_name(code):
+    filename = code.co_filename
+    prefix = max((path for path in sys.path if path and filename.startswith(path)), key=len, default='')
+    filename = filename[len(prefix):].lstrip(os.sep)
+    return f'{code.co_name} ({filename}:{code.co_firstlineno})'.replace(';', ':')
+
+
+class StackSampler:
+    # Polls one thread's Python stack from a background thread and counts the
+    # folded stacks. The profiled thread runs untouched between samples.
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = Counter()
+        self._names = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, thread_id):
+        self._target = thread_id
+        self._thread = threading.Thread(target=self._run, name='chat-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+        return self.samples
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._target)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                name = self._names.get(code)
+                if name is None:
+                    name = self._names[code] = _frame_name(code)
+                stack.append(name)
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+
+def save_profile(samples, **meta):
+    # Writes the samples in Brendan Gregg's folded format, which flamegraph.pl,
+    # inferno and speedscope open directly, plus a JSON sidecar for listing.
+    # The oldest profiles beyond PROFILE_MAX_FILES are removed.
+    directory = settings.PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    profile_id = f'{time.time_ns() // 1_000_000}-{secrets.token_hex(4)}'
+    with open(os.path.join(directory, f'{profile_id}.folded'), 'w') as f:
+        for stack, n in samples.most_common():
+            f.write(f'{stack} {n}\n')
+    meta.update(
+        id=profile_id, samples=sum(samples.values()),
+        created_at=datetime.now(timezone.utc).isoformat()
+    )
+    with open(os.path.join(directory, f'{profile_id}.json'), 'w') as f:
+        json.dump(meta, f)
+
+    for old_id in _profile_ids()[settings.PROFILE_MAX_FILES:]:
+        for ext in ('.folded', '.json'):
+            try:
+                os.remove(os.path.join(directory, old_id + ext))
+            except FileNotFoundError:
+                pass
+    return profile_id
+
+
+def _profile_ids():
+    try:
+        names = os.listdir(settings.PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    ids = [name[:-len('.json')] for name in names if name.endswith('.json') and PROFILE_ID_RE.match(name[:-len('.json')])]
+    return sorted(ids, key=lambda profile_id: int(profile_id.split('-')[0]), reverse=True)
+
+
+def list_profiles():
+    profiles = []
+    for profile_id in _profile_ids():
+        try:
+            with open(os.path.join(settings.PROFILE_DIR, f'{profile_id}.json')) as f:
+                profiles.append(json.load(f))
+        except (FileNotFoundError, ValueError):
+            continue
+    return profiles
+
+
+def profile_path(profile_id):
+    if not PROFILE_ID_RE.match(profile_id or ''):
+        return None
+    path = os.path.join(settings.PROFILE_DIR, f'{profile_id}.folded')
+    return path if os.path.exists(path) else None
@@ -0,0 +1,79 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+import datetime
+import decimal
+import re
+import uuid
+
+import msgpack
+
+# UUIDs travel as 16 raw bytes in an ext type instead of 36-character strings.
+UUID_EXT_TYPE = 1
+
+re_uuid = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$')
+
+# Serializers render ids as strings, so only the values of these keys (and of
+# keys ending in _id) are packed; free text such as message content that
+# happens to look like a UUID stays a string.
+UUID_KEYS = {'id', 'conversation', 'message', 'recipient'}
+
+
+def _is_uuid_key(key):
+    return isinstance(key, str) and (key in UUID_KEYS or key.endswith('_id'))
+
+
+def _compact(data, uuid_field=False):
+    if isinstance(data, dict):
+        return {key: _compact(value, _is_uuid_key(key)) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [_compact(value, uuid_field) for value in data]
+    if uuid_field and isinstance(data, str) and len(data) == 36 and re_uuid.match(data):
+        return msgpack.ExtType(UUID_EXT_TYPE, uuid.UUID(data).bytes)
+    return data
+
+
+def _default(obj):
+    if isinstance(obj, uuid.UUID):
+        return msgpack.ExtType(UUID_EXT_TYPE, obj.bytes)
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, decimal.Decimal):
+        return str(obj)
+    raise TypeError(f'Cannot serialize {type(obj).__name__} to MessagePack')
+
+
+def _ext_hook(code, data):
+    if code == UUID_EXT_TYPE:
+        return str(uuid.UUID(bytes=data))
+    return msgpack.ExtType(code, data)
+
+
+def packb(data):
+    return msgpack.packb(_compact(data), default=_default, use_bin_type=True)
+
+
+def unpackb(data):
+    return msgpack.unpackb(data, ext_hook=_ext_hook, raw=False)
+
+
+class MessagePackRenderer(BaseRenderer):
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return packb(data)
+
+
+class MessagePackParser(BaseParser):
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return unpackb(stream.read())
+        except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as exc:
+            raise ParseError(f'MessagePack parse error - {exc}')
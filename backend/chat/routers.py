@@ -0,0 +1,75 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+import uuid
+
+# Rows that belong to one conversation live on the shard its UUID hashes to.
+# Everything else (users, the user-to-conversation directory, membership
+# events, per-user counters and Django's own apps) stays on "default".
+SHARDED_MODELS = {
+    'conversation', 'participant', 'message', 'filemessage', 'deliveryreceipt', 'conversationstorageusage',
+}
+
+
+def _jump_hash(key, buckets):
+    # Lamping and Veach's jump consistent hash: going from n to n + 1 buckets
+    # moves only the keys that land in the new one, about 1/(n + 1) of them.
+    # Buckets can only be added at the end.
+    bucket, jump = -1, 0
+    while jump < buckets:
+        bucket = jump
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        jump = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_for(conversation_id):
+    aliases = settings.CHAT_SHARDS
+    if len(aliases) == 1:
+        return aliases[0]
+    if not isinstance(conversation_id, uuid.UUID):
+        try:
+            conversation_id = uuid.UUID(str(conversation_id))
+        except ValueError:
+            raise ValidationError(f'"{conversation_id}" is not a valid UUID.')
+    key = (conversation_id.int >> 64) ^ (conversation_id.int & 0xFFFFFFFFFFFFFFFF)
+    return aliases[_jump_hash(key, len(aliases))]
+
+
+def is_sharded(model):
+    return model._meta.app_label == 'chat' and model._meta.model_name in SHARDED_MODELS
+
+
+def instance_shard(instance):
+    name = instance._meta.model_name
+    if name == 'conversation':
+        return shard_for(instance.pk)
+    if getattr(instance, 'conversation_id', None):
+        return shard_for(instance.conversation_id)
+    if name in ('filemessage', 'deliveryreceipt') and instance._meta.get_field('message').is_cached(instance):
+        return instance_shard(instance.message)
+    return instance._state.db
+
+
+class ShardRouter:
+    def db_for_read(self, model, **hints):
+        if not is_sharded(model):
+            return 'default'
+        instance = hints.get('instance')
+        if instance is not None and is_sharded(type(instance)):
+            return instance_shard(instance)
+        # No instance to go by: callers pick the shard with .using()
+        return None
+
+    db_for_write = db_for_read
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if app_label == 'chat' and model_name in SHARDED_MODELS:
+            return db in settings.CHAT_SHARDS
+        if app_label == 'chat' and model_name == 'user':
+            # Shards get an empty chat_user as the target of the foreign keys
+            # 0001 and 0002 create, until 0008 drops them
+            return db == 'default' or db in settings.CHAT_SHARDS
+        return db == 'default'
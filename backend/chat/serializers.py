@@ -1,7 +1,19 @@
 from rest_framework import serializers
-from .models import User, Conversation, Message, FileMessage, Participant, DeliveryReceipt
+from .models import User, Conversation, Message, FileMessage, Participant, DeliveryReceipt, MembershipEvent
+from .routers import shard_for
+from .presence import ONLINE_WINDOW
+from django.core.exceptions import ValidationError
 from django.utils import timezone
-from datetime import timedelta
+
+
+class ConversationField(serializers.PrimaryKeyRelatedField):
+    # Looks the conversation up on its own shard rather than on default
+    def to_internal_value(self, data):
+        try:
+            self.queryset = Conversation.objects.using(shard_for(data))
+        except ValidationError:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        return super().to_internal_value(data)
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -13,9 +25,7 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['id', 'username', 'avatar_url', 'created_at', 'is_online', 'last_activity', 'offline_minutes']
 
     def get_is_online(self, obj):
-        now = timezone.now()
-        thirty_mins_ago = now - timedelta(minutes=30)
-        return obj.last_activity > thirty_mins_ago
+        return obj.last_activity > timezone.now() - ONLINE_WINDOW
 
     def get_offline_minutes(self, obj):
         now = timezone.now()
@@ -35,6 +45,7 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 class MessageSerializer(serializers.ModelSerializer):
+    conversation = ConversationField(queryset=Conversation.objects.all())
     sender = UserSerializer(read_only=True)
     file = serializers.SerializerMethodField()
 
@@ -76,3 +87,9 @@ class DeliveryReceiptSerializer(serializers.ModelSerializer):
     class Meta:
         model = DeliveryReceipt
         fields = ['id', 'message', 'recipient', 'delivered', 'read', 'delivered_at', 'read_at']
+
+
+class MembershipEventSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MembershipEvent
+        fields = ['id', 'conversation_id', 'user_id', 'action', 'created_at']
@@ -0,0 +1,83 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import Http404
+from collections import defaultdict
+from itertools import chain
+
+from .models import Conversation, UserConversation
+from .routers import shard_for
+
+
+def group_by_shard(conversation_ids):
+    shards = defaultdict(list)
+    for conversation_id in conversation_ids:
+        shards[shard_for(conversation_id)].append(conversation_id)
+    return shards
+
+
+def user_conversation_ids(user_id):
+    return list(UserConversation.objects.filter(user_id=user_id).values_list('conversation_id', flat=True))
+
+
+def conversations_for_user(user_id, prefetch=()):
+    conversations = []
+    for alias, ids in group_by_shard(user_conversation_ids(user_id)).items():
+        conversations += Conversation.objects.using(alias).filter(id__in=ids).prefetch_related(*prefetch)
+    return sorted(conversations, key=lambda conversation: conversation.created_at, reverse=True)
+
+
+def get_conversation_or_404(conversation_id, queryset=None):
+    queryset = Conversation.objects.all() if queryset is None else queryset
+    try:
+        return queryset.using(shard_for(conversation_id)).get(id=conversation_id)
+    except (Conversation.DoesNotExist, ValidationError):
+        raise Http404('No Conversation matches the given query.')
+
+
+def get_from_any_shard(queryset, **lookup):
+    # For rows addressed by their own id (messages, files), which don't say
+    # which conversation they belong to
+    for alias in settings.CHAT_SHARDS:
+        try:
+            obj = queryset.using(alias).filter(**lookup).first()
+        except ValidationError:
+            break
+        if obj is not None:
+            return obj
+    raise Http404(f'No {queryset.model._meta.object_name} matches the given query.')
+
+
+class ShardedQuerySet:
+    # The same query run on every shard, concatenated, for paginated list
+    # endpoints. Rows are ordered within each shard, not across shards.
+    def __init__(self, queryset):
+        self.model = queryset.model
+        self.querysets = [queryset.using(alias) for alias in settings.CHAT_SHARDS]
+
+    @property
+    def ordered(self):
+        return all(queryset.ordered for queryset in self.querysets)
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.querysets)
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return chain.from_iterable(self.querysets)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        start, stop = index.start or 0, index.stop
+        rows = []
+        for queryset in self.querysets:
+            if stop is not None and stop <= 0:
+                break
+            size = queryset.count()
+            if start < size:
+                rows += queryset[start:stop]
+            start = max(0, start - size)
+            stop = None if stop is None else stop - size
+        return rows
@@ -0,0 +1,97 @@
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+from contextlib import contextmanager
+import threading
+
+from .models import User, Conversation, Participant, MembershipEvent, Message, MessageDeletion, FileMessage, DeliveryReceipt, UserConversation
+from .storage_usage import record_usage
+from .membership import PRESENCE_FIELDS, invalidate_conversation, invalidate_user
+
+_state = threading.local()
+
+
+@contextmanager
+def tracking_suppressed():
+    # For copying rows between shards, where deleting the source copy must not
+    # look like members leaving or files being removed.
+    _state.suppressed = True
+    try:
+        yield
+    finally:
+        _state.suppressed = False
+
+
+def _suppressed():
+    return getattr(_state, 'suppressed', False)
+
+
+@receiver(post_save, sender=Participant)
+def record_join(sender, instance, created, **kwargs):
+    if created and not _suppressed():
+        UserConversation.objects.get_or_create(user_id=instance.user_id, conversation_id=instance.conversation_id)
+        MembershipEvent.objects.create(conversation_id=instance.conversation_id, user_id=instance.user_id, action='joined')
+
+
+@receiver(post_delete, sender=Participant)
+def record_leave(sender, instance, **kwargs):
+    if _suppressed():
+        return
+    UserConversation.objects.filter(user_id=instance.user_id, conversation_id=instance.conversation_id).delete()
+    MembershipEvent.objects.create(conversation_id=instance.conversation_id, user_id=instance.user_id, action='left')
+
+
+@receiver(post_delete, sender=Message)
+def record_message_deleted(sender, instance, **kwargs):
+    if not _suppressed():
+        MessageDeletion.objects.create(message_id=instance.pk, conversation_id=instance.conversation_id)
+
+
+@receiver(post_save, sender=Participant)
+@receiver(post_delete, sender=Participant)
+def invalidate_members(sender, instance, **kwargs):
+    invalidate_conversation(instance.conversation_id)
+
+
+@receiver(post_delete, sender=Conversation)
+def invalidate_deleted_conversation(sender, instance, **kwargs):
+    invalidate_conversation(instance.pk)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_sender(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= PRESENCE_FIELDS:
+        return
+    invalidate_user(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def delete_user_rows(sender, instance, using, **kwargs):
+    # Foreign keys to User carry no constraint across databases, so the
+    # delete only cascaded on the user's own database. Messages and receipts
+    # can outlive a membership, so every other shard is cleaned, not only
+    # those in the directory.
+    for alias in settings.CHAT_SHARDS:
+        if alias == using:
+            continue
+        Conversation.objects.using(alias).filter(group_admin_id=instance.pk).update(group_admin=None)
+        Participant.objects.using(alias).filter(user_id=instance.pk).delete()
+        DeliveryReceipt.objects.using(alias).filter(recipient_id=instance.pk).delete()
+        Message.objects.using(alias).filter(sender_id=instance.pk).delete()
+
+
+@receiver(post_save, sender=FileMessage)
+def record_file_added(sender, instance, created, **kwargs):
+    if created and not _suppressed():
+        record_usage(instance.message.sender_id, instance.message.conversation_id, instance.size_bytes)
+
+
+@receiver(pre_delete, sender=FileMessage)
+def record_file_removed(sender, instance, **kwargs):
+    if _suppressed():
+        return
+    # pre_delete because a cascade from Message has removed the message row by post_delete
+    owner = Message.objects.using(instance._state.db).filter(pk=instance.message_id).values('sender_id', 'conversation_id').first()
+    if owner:
+        record_usage(owner['sender_id'], owner['conversation_id'], -instance.size_bytes, files=-1)
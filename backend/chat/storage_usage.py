@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Value
+
+from .models import UserStorageUsage, ConversationStorageUsage
+from .routers import shard_for
+
+
+def _apply(model, key_field, key, size_bytes, files, using='default'):
+    updated = model.objects.using(using).filter(**{key_field: key}).update(
+        bytes_used=F('bytes_used') + size_bytes,
+        file_count=F('file_count') + files
+    )
+    if updated or files < 0:
+        # A missing row on removal means the counters predate accounting;
+        # reconcile_storage rebuilds them.
+        return
+    try:
+        with transaction.atomic(using=using):
+            model.objects.using(using).create(**{key_field: key, 'bytes_used': size_bytes, 'file_count': files})
+    except IntegrityError:
+        _apply(model, key_field, key, size_bytes, files, using)
+
+
+def record_usage(user_id, conversation_id, size_bytes, files=1):
+    _apply(UserStorageUsage, 'user_id', user_id, size_bytes, files)
+    _apply(ConversationStorageUsage, 'conversation_id', conversation_id, size_bytes, files, shard_for(conversation_id))
+
+
+def quota_error(user_id, conversation_id, size_bytes):
+    # The user's counter is on default and the conversation's on its shard:
+    # one query when that shard is default, otherwise one on each database.
+    user_quota = settings.USER_STORAGE_QUOTA_BYTES
+    conversation_quota = settings.CONVERSATION_STORAGE_QUOTA_BYTES
+    alias = shard_for(conversation_id)
+    user_usage = UserStorageUsage.objects.filter(user_id=user_id).annotate(
+        kind=Value('user')
+    ).values_list('kind', 'bytes_used')
+    conversation_usage = ConversationStorageUsage.objects.using(alias).filter(conversation_id=conversation_id).annotate(
+        kind=Value('conversation')
+    ).values_list('kind', 'bytes_used')
+
+    if user_quota and conversation_quota and alias == 'default':
+        used = dict(user_usage.union(conversation_usage, all=True))
+    else:
+        used = {}
+        if user_quota:
+            used.update(user_usage)
+        if conversation_quota:
+            used.update(conversation_usage)
+
+    if user_quota and used.get('user', 0) + size_bytes > user_quota:
+        return f'Storage quota exceeded: {user_quota / (1024**3):.1f}GB per user'
+    if conversation_quota and used.get('conversation', 0) + size_bytes > conversation_quota:
+        return f'Storage quota exceeded: {conversation_quota / (1024**3):.1f}GB per conversation'
+    return None
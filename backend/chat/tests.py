@@ -0,0 +1,175 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from io import StringIO
+from unittest import mock, skipUnless
+import uuid
+
+from .membership import local_cache
+from .models import User, Conversation, Participant, Message, DeliveryReceipt, UserConversation, MessageDeletion
+from .routers import shard_for
+
+# Run with several databases to cover the shard routing:
+#   SQLITE_SHARDS=3 python manage.py test chat
+SHARDED = len(settings.CHAT_SHARDS) > 1
+needs_shards = skipUnless(SHARDED, 'set SQLITE_SHARDS=3 or SHARD_DATABASE_URLS')
+
+
+class ChatTestCase(TestCase):
+    databases = set(settings.CHAT_SHARDS)
+
+    def setUp(self):
+        # Rate limit buckets and cached members outlive each test's rollback
+        cache.clear()
+        local_cache.clear()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+
+    def post(self, url, data, **extra):
+        return self.client.post(url, data, content_type='application/json', **extra)
+
+    def direct_conversation(self, user, other):
+        response = self.post('/api/conversations/get_or_create/', {'user_id': str(user.id), 'other_user_id': str(other.id)})
+        self.assertEqual(response.status_code, 200)
+        return response.json()['id']
+
+    def id_on(self, alias):
+        while True:
+            conversation_id = uuid.uuid4()
+            if shard_for(conversation_id) == alias:
+                return conversation_id
+
+
+class RoutingTests(ChatTestCase):
+    @needs_shards
+    def test_conversation_rows_live_on_its_shard(self):
+        conversation_id = self.direct_conversation(self.alice, self.bob)
+        response = self.post('/api/messages/send/', {
+            'conversation_id': conversation_id, 'sender_id': str(self.alice.id), 'content': 'hi'
+        })
+        self.assertEqual(response.status_code, 201)
+
+        home = shard_for(conversation_id)
+        for alias in settings.CHAT_SHARDS:
+            expected = 1 if alias == home else 0
+            self.assertEqual(Conversation.objects.using(alias).filter(pk=conversation_id).count(), expected)
+            self.assertEqual(Message.objects.using(alias).filter(conversation_id=conversation_id).count(), expected)
+            self.assertEqual(Participant.objects.using(alias).filter(conversation_id=conversation_id).count(), 2 * expected)
+        self.assertEqual(DeliveryReceipt.objects.using(home).filter(recipient=self.bob).count(), 1)
+        # The directory stays on default next to the users
+        self.assertEqual(UserConversation.objects.filter(conversation_id=conversation_id).count(), 2)
+
+    def test_shard_for_is_stable(self):
+        conversation_id = uuid.uuid4()
+        self.assertEqual(shard_for(conversation_id), shard_for(str(conversation_id)))
+        self.assertIn(shard_for(conversation_id), settings.CHAT_SHARDS)
+
+    @needs_shards
+    def test_by_user_reads_every_shard(self):
+        created = set()
+        for i in range(8):
+            other = User.objects.create(username=f'friend{i}')
+            created.add(self.direct_conversation(self.alice, other))
+        self.assertGreater(len({shard_for(conversation_id) for conversation_id in created}), 1)
+
+        response = self.client.get('/api/conversations/by_user/', {'user_id': str(self.alice.id)})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({conversation['id'] for conversation in response.json()}, created)
+
+    @needs_shards
+    def test_rebalance_moves_rows_to_their_shard(self):
+        target = settings.CHAT_SHARDS[-1]
+        conversation_id = self.id_on(target)
+        # As if the conversation was written before its shard was added
+        with override_settings(CHAT_SHARDS=['default']):
+            conversation = Conversation.objects.create(id=conversation_id, type='one_to_one')
+            Participant.objects.create(conversation=conversation, user=self.alice)
+            Participant.objects.create(conversation=conversation, user=self.bob)
+            message = Message.objects.create(conversation=conversation, sender=self.alice, content='hi')
+            DeliveryReceipt.objects.create(message=message, recipient=self.bob)
+
+        call_command('rebalance_shards', stdout=StringIO())
+
+        self.assertFalse(Conversation.objects.using('default').filter(pk=conversation_id).exists())
+        self.assertFalse(Message.objects.using('default').filter(conversation_id=conversation_id).exists())
+        self.assertTrue(Conversation.objects.using(target).filter(pk=conversation_id).exists())
+        self.assertEqual(Participant.objects.using(target).filter(conversation_id=conversation_id).count(), 2)
+        self.assertEqual(Message.objects.using(target).get(pk=message.pk).content, 'hi')
+        self.assertTrue(DeliveryReceipt.objects.using(target).filter(message_id=message.pk, recipient=self.bob).exists())
+        # Moving is not leaving: no tombstones or membership events
+        self.assertFalse(MessageDeletion.objects.filter(message_id=message.pk).exists())
+
+
+class SyncTests(ChatTestCase):
+    def sync(self, token=None, user=None):
+        response = self.post('/api/sync/', {'user_id': str((user or self.alice).id), 'sync_token': token})
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_deltas_since_token(self):
+        conversation_id = self.direct_conversation(self.alice, self.bob)
+        token = self.sync()['sync_token']
+
+        sent = self.post('/api/messages/send/', {
+            'conversation_id': conversation_id, 'sender_id': str(self.bob.id), 'content': 'hello'
+        }).json()
+        data = self.sync(token)
+        self.assertFalse(data['full_resync'])
+        self.assertEqual([message['id'] for message in data['messages']], [sent['id']])
+
+        Message.objects.using(shard_for(conversation_id)).get(pk=sent['id']).delete()
+        self.assertIn(sent['id'], self.sync(data['sync_token'])['removed_messages'])
+
+    def test_membership_events(self):
+        token = self.sync()['sync_token']
+        response = self.post('/api/conversations/create_group/', {'user_id': str(self.bob.id), 'group_name': 'team'})
+        self.assertEqual(response.status_code, 201)
+        group_id = response.json()['id']
+        response = self.post(f'/api/conversations/{group_id}/add_member/', {
+            'user_id': str(self.alice.id), 'requester_id': str(self.bob.id)
+        })
+        self.assertEqual(response.status_code, 200)
+
+        memberships = self.sync(token)['memberships']
+        self.assertIn((group_id, str(self.alice.id), 'joined'), {
+            (event['conversation_id'], event['user_id'], event['action']) for event in memberships
+        })
+
+    def test_expired_token_asks_for_full_resync(self):
+        token = self.sync()['sync_token']
+        with override_settings(SYNC_TOKEN_MAX_AGE=-1):
+            data = self.sync(token)
+        self.assertTrue(data['full_resync'])
+        self.assertNotEqual(data['sync_token'], token)
+
+    def test_invalid_token(self):
+        response = self.post('/api/sync/', {'user_id': str(self.alice.id), 'sync_token': 'junk'})
+        self.assertEqual(response.status_code, 400)
+
+
+class UploadTests(ChatTestCase):
+    def upload(self, name, content=b'data'):
+        conversation_id = self.direct_conversation(self.alice, self.bob)
+        return self.client.post(f'/api/files/upload/?sender_id={self.alice.id}', {
+            'file': SimpleUploadedFile(name, content),
+            'conversation_id': conversation_id,
+            'sender_id': str(self.alice.id),
+        })
+
+    def test_rejects_dangerous_extension(self):
+        response = self.upload('setup.exe')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error'], 'File type .exe is not allowed')
+
+    def test_rejects_oversized_file_while_receiving(self):
+        with mock.patch('chat.uploadhandlers.MAX_FILE_SIZE', 3):
+            response = self.upload('notes.txt')
+        self.assertEqual(response.status_code, 413)
+
+    @override_settings(USER_STORAGE_QUOTA_BYTES=2)
+    def test_rejects_over_quota(self):
+        response = self.upload('notes.txt')
+        self.assertEqual(response.status_code, 413)
+        self.assertIn('Storage quota exceeded', response.json()['error'])
@@ -0,0 +1,86 @@
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+import time
+
+DURATIONS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    num, period = rate.split('/')
+    return int(num), DURATIONS[period[0]]
+
+
+def count(name):
+    key = f'ratelimit:count:{name}'
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def counters():
+    names = []
+    for action in settings.CHAT_RATE_LIMITS:
+        names += [f'{action}:allowed', f'{action}:throttled']
+    names.append('shed')
+    values = cache.get_many([f'ratelimit:count:{name}' for name in names])
+    return {name: values.get(f'ratelimit:count:{name}', 0) for name in names}
+
+
+def check_rate_limit(action, user_id, ip):
+    # Takes one token from each of the action's per-user and per-IP buckets and
+    # returns 0, or the seconds until the emptiest bucket refills. The update is
+    # not atomic, so concurrent workers may let a few extra requests through.
+    limits = settings.CHAT_RATE_LIMITS.get(action)
+    if not limits:
+        return 0
+
+    idents = {'user': user_id, 'ip': ip}
+    buckets = {}
+    for kind, rate in limits.items():
+        if idents.get(kind):
+            buckets[f'ratelimit:{action}:{kind}:{idents[kind]}'] = parse_rate(rate)
+    if not buckets:
+        return 0
+
+    now = time.time()
+    state = cache.get_many(buckets.keys())
+    wait = 0
+    updates = {}
+    for key, (capacity, period) in buckets.items():
+        refill = capacity / period
+        tokens, stamp = state.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - stamp) * refill)
+        if tokens < 1:
+            wait = max(wait, (1 - tokens) / refill)
+        updates[key] = (tokens - 1, now)
+
+    if wait:
+        count(f'{action}:throttled')
+        return wait
+
+    cache.set_many(updates, timeout=max(period for _, period in buckets.values()) + 1)
+    count(f'{action}:allowed')
+    return 0
+
+
+class ActionRateThrottle(BaseThrottle):
+    def allow_request(self, request, view):
+        action = f"{getattr(view, 'basename', '')}.{getattr(view, 'action', '')}"
+        if action not in settings.CHAT_RATE_LIMITS:
+            return True
+
+        if request.content_type.startswith('multipart/'):
+            # Reading request.data would store the whole upload before the
+            # throttle could refuse it, so uploads name the user in the URL
+            data = request.query_params
+        else:
+            data = request.data
+        user_id = data.get('user_id') or data.get('sender_id') or request.query_params.get('user_id')
+        self.wait_seconds = check_rate_limit(action, user_id, self.get_ident(request))
+        return not self.wait_seconds
+
+    def wait(self):
+        return self.wait_seconds
@@ -0,0 +1,41 @@
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+import hashlib
+
+DANGEROUS_EXTENSIONS = ['exe', 'bat', 'cmd', 'com', 'scr', 'vbs', 'js', 'jar', 'zip']
+MAX_FILE_SIZE = 1024 * 1024 * 1024
+
+
+class HashingUploadHandler(TemporaryFileUploadHandler):
+    # Streams the upload into FILE_UPLOAD_TEMP_DIR, which sits on the same
+    # filesystem as MEDIA_ROOT so default_storage.save() can rename it into
+    # place, and computes the SHA-256 as chunks arrive. Rejected files are
+    # skipped and the reason is left on request.upload_rejection.
+
+    def new_file(self, field_name, file_name, content_type, content_length, *args, **kwargs):
+        self.field_name = field_name
+        file_ext = file_name.lower().split('.')[-1]
+        if file_ext in DANGEROUS_EXTENSIONS:
+            self.reject(f'File type .{file_ext} is not allowed', 400)
+        if content_length is not None and content_length > MAX_FILE_SIZE:
+            self.reject(f'File size exceeds {MAX_FILE_SIZE / (1024**3):.1f}GB limit', 413)
+
+        super().new_file(field_name, file_name, content_type, content_length, *args, **kwargs)
+        self.sha256 = hashlib.sha256()
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > MAX_FILE_SIZE:
+            self.reject(f'File size exceeds {MAX_FILE_SIZE / (1024**3):.1f}GB limit', 413)
+        self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file_obj = super().file_complete(file_size)
+        file_obj.sha256 = self.sha256.hexdigest()
+        return file_obj
+
+    def reject(self, message, status_code):
+        if self.field_name == 'file':
+            self.request.upload_rejection = (message, status_code)
+        raise SkipFile()
@@ -1,13 +1,25 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import UserViewSet, ConversationViewSet, MessageViewSet, FileUploadViewSet
+from .views import UserViewSet, ConversationViewSet, MessageViewSet, FileUploadViewSet, SyncViewSet, MetricsViewSet, ProfileViewSet
+from . import async_views
 
 router = DefaultRouter()
 router.register(r'users', UserViewSet)
 router.register(r'conversations', ConversationViewSet)
 router.register(r'messages', MessageViewSet)
 router.register(r'files', FileUploadViewSet, basename='file')
+router.register(r'sync', SyncViewSet, basename='sync')
+router.register(r'metrics', MetricsViewSet, basename='metrics')
+router.register(r'profiles', ProfileViewSet, basename='profile')
 
+# The hot endpoints are served by async views; they must come before the
+# router, whose detail routes would otherwise match them
 urlpatterns = [
+    path('users/track_activity/', async_views.track_activity),
+    path('conversations/by_user/', async_views.by_user),
+    path('conversations/messages/', async_views.messages),
+    path('conversations/<uuid:pk>/', async_views.conversation_detail),
+    path('messages/send/', async_views.send),
+    path('files/download/', async_views.download),
     path('', include(router.urls)),
 ]
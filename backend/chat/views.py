@@ -2,20 +2,43 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.request import Request
+from rest_framework.exceptions import PermissionDenied
 from django.shortcuts import get_object_or_404
+from django.http import Http404
+from django.core.exceptions import ValidationError
 from django.utils import timezone
+from django.core import signing
+from django.db.models import Q
 from django.core.files.storage import default_storage
+from django.http import FileResponse, StreamingHttpResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.utils.http import content_disposition_header
 from django.conf import settings
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone as dt_timezone
 import os
 import hashlib
 
-from .models import User, Conversation, Message, FileMessage, Participant, DeliveryReceipt
+from .models import User, Conversation, Message, FileMessage, Participant, DeliveryReceipt, MembershipEvent, MessageDeletion
+from .routers import shard_for
+from .sharding import ShardedQuerySet, user_conversation_ids, group_by_shard, get_from_any_shard
+from .throttling import counters
+from .profiling import valid_token, list_profiles, profile_path
+from .export import ExportStats, ndjson_parts, zip_parts, as_async
+from .storage_usage import quota_error
+from .presence import mark_active, presence_changes
+from .membership import conversation_members, cached_user, parse_id, ensure_member, create_receipts
+from .uploadhandlers import HashingUploadHandler, DANGEROUS_EXTENSIONS, MAX_FILE_SIZE
+from .middleware import AdmissionControlMiddleware
 from .serializers import (
     UserSerializer, ConversationSerializer, MessageSerializer,
-    FileMessageSerializer, DeliveryReceiptSerializer
+    FileMessageSerializer, DeliveryReceiptSerializer, MembershipEventSerializer
 )
 
+SYNC_TOKEN_SALT = 'chat.sync'
+# Rows are stamped before their transaction commits, so re-scan a short window
+# behind the previous token; clients de-duplicate deltas by id.
+SYNC_OVERLAP = timedelta(seconds=2)
+
 
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
@@ -45,26 +68,9 @@ class UserViewSet(viewsets.ModelViewSet):
         )
         
         # Always update activity on login
-        user.last_activity = timezone.now()
-        user.is_online = True
-        user.save(update_fields=['last_activity', 'is_online'])
+        mark_active(user, timezone.now())
         return Response(UserSerializer(user).data, status=status.HTTP_200_OK)
 
-    @action(detail=False, methods=['post'])
-    def track_activity(self, request):
-        user_id = request.data.get('user_id')
-        if not user_id:
-            return Response({'error': 'user_id required'}, status=status.HTTP_400_BAD_REQUEST)
-
-        try:
-            user = User.objects.get(id=user_id)
-            user.last_activity = timezone.now()
-            user.is_online = True
-            user.save()
-            return Response({'status': 'updated'}, status=status.HTTP_200_OK)
-        except User.DoesNotExist:
-            return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
-
     @action(detail=False, methods=['post'])
     def logout(self, request):
         user_id = request.data.get('user_id')
@@ -74,7 +80,7 @@ class UserViewSet(viewsets.ModelViewSet):
         try:
             user = User.objects.get(id=user_id)
             user.is_online = False
-            user.save(update_fields=['is_online'])
+            user.save(update_fields=['is_online', 'updated_at'])
             return Response({'status': 'logged out'}, status=status.HTTP_200_OK)
         except User.DoesNotExist:
             return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
@@ -89,6 +95,14 @@ class ConversationViewSet(viewsets.ModelViewSet):
     queryset = Conversation.objects.all()
     serializer_class = ConversationSerializer
 
+    def get_queryset(self):
+        if 'pk' in self.kwargs:
+            try:
+                return Conversation.objects.using(shard_for(self.kwargs['pk']))
+            except ValidationError:
+                raise Http404
+        return ShardedQuerySet(Conversation.objects.order_by('-created_at'))
+
     @action(detail=False, methods=['post'])
     def get_or_create(self, request):
         user_id = request.data.get('user_id')
@@ -100,45 +114,31 @@ class ConversationViewSet(viewsets.ModelViewSet):
         user = get_object_or_404(User, id=user_id)
         other_user = get_object_or_404(User, id=other_user_id)
 
-        conversations = Conversation.objects.filter(
-            type='one_to_one',
-            participant__user=user
-        ).filter(
-            participant__user=other_user
-        ).distinct()
+        shared_ids = set(user_conversation_ids(user.id)) & set(user_conversation_ids(other_user.id))
+        conv = None
+        for alias, ids in group_by_shard(shared_ids).items():
+            conv = conv or Conversation.objects.using(alias).filter(id__in=ids, type='one_to_one').first()
 
-        if conversations.exists():
-            conv = conversations.first()
-        else:
+        if conv is None:
             conv = Conversation.objects.create(type='one_to_one')
             Participant.objects.create(conversation=conv, user=user)
             Participant.objects.create(conversation=conv, user=other_user)
 
         return Response(ConversationSerializer(conv).data, status=status.HTTP_200_OK)
 
-    @action(detail=False, methods=['get'])
-    def messages(self, request, pk=None):
-        conversation_id = request.query_params.get('conversation_id')
-        if not conversation_id:
-            return Response({'error': 'conversation_id required'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        conversation = get_object_or_404(Conversation, id=conversation_id)
-        messages = conversation.messages.filter(expires_at__gt=timezone.now())
-        return Response(MessageSerializer(messages, many=True).data)
-
-    @action(detail=False, methods=['get'])
-    def by_user(self, request):
-        user_id = request.query_params.get('user_id')
-        if not user_id:
-            return Response({'error': 'user_id required'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        user = get_object_or_404(User, id=user_id)
-        conversations = Conversation.objects.filter(
-            participant__user=user
-        ).select_related('group_admin').prefetch_related(
-            'participant_set__user', 'messages__sender'
-        ).distinct().order_by('-created_at')
-        return Response(ConversationSerializer(conversations, many=True).data)
+    @action(detail=True, methods=['get'])
+    def export(self, request, pk=None):
+        conversation = self.get_object()
+        stats = ExportStats()
+        if request.query_params.get('files') in ('1', 'true'):
+            parts, content_type, filename = zip_parts(conversation, stats), 'application/zip', f'conversation-{pk}.zip'
+        else:
+            parts, content_type, filename = ndjson_parts(conversation, stats), 'application/x-ndjson', f'conversation-{pk}.ndjson'
+        if isinstance(request._request, ASGIRequest):
+            parts = as_async(parts)
+        response = StreamingHttpResponse(parts, content_type=content_type)
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+        return response
 
     @action(detail=False, methods=['post'])
     def create_group(self, request):
@@ -200,7 +200,7 @@ class ConversationViewSet(viewsets.ModelViewSet):
 
         user = get_object_or_404(User, id=user_id)
 
-        if Participant.objects.filter(conversation=conversation, user=user).exists():
+        if conversation.participant_set.filter(user=user).exists():
             return Response({'error': 'User already in group'}, status=status.HTTP_400_BAD_REQUEST)
 
         Participant.objects.create(conversation=conversation, user=user)
@@ -221,53 +221,22 @@ class ConversationViewSet(viewsets.ModelViewSet):
             return Response({'error': 'Only admin can remove members'}, status=status.HTTP_403_FORBIDDEN)
 
         user = get_object_or_404(User, id=user_id)
-        Participant.objects.filter(conversation=conversation, user=user).delete()
+        conversation.participant_set.filter(user=user).delete()
 
         return Response(ConversationSerializer(conversation).data, status=status.HTTP_200_OK)
 
 
 class MessageViewSet(viewsets.ModelViewSet):
-    queryset = Message.objects.all().select_related('sender', 'conversation')
+    queryset = Message.objects.all().select_related('conversation').prefetch_related('sender')
     serializer_class = MessageSerializer
 
-    @action(detail=False, methods=['post'])
-    def send(self, request):
-        from datetime import timedelta
-        from django.utils import timezone
-        
-        conversation_id = request.data.get('conversation_id')
-        sender_id = request.data.get('sender_id')
-        content = request.data.get('content', '').strip()
-        content_type = request.data.get('content_type', 'text')
-
-        if not conversation_id or not sender_id or not content:
-            return Response({'error': 'Missing required fields'}, status=status.HTTP_400_BAD_REQUEST)
+    def get_queryset(self):
+        return ShardedQuerySet(super().get_queryset())
 
-        try:
-            conversation = Conversation.objects.get(id=conversation_id)
-            sender = User.objects.get(id=sender_id)
-        except (Conversation.DoesNotExist, User.DoesNotExist):
-            return Response({'error': 'Conversation or user not found'}, status=status.HTTP_404_NOT_FOUND)
-
-        # Check if sender is a participant, if not add them
-        if not Participant.objects.filter(conversation=conversation, user=sender).exists():
-            Participant.objects.create(conversation=conversation, user=sender)
-
-        expires_at = timezone.now() + timedelta(hours=sender.auto_delete_hours)
-
-        message = Message.objects.create(
-            conversation=conversation,
-            sender=sender,
-            content=content,
-            content_type=content_type,
-            expires_at=expires_at
-        )
-
-        # Create delivery receipts for other participants
-        for participant in conversation.participant_set.exclude(user=sender):
-            DeliveryReceipt.objects.create(message=message, recipient=participant.user)
-
-        return Response(MessageSerializer(message).data, status=status.HTTP_201_CREATED)
+    def get_object(self):
+        message = get_from_any_shard(Message.objects.select_related('conversation'), pk=self.kwargs['pk'])
+        self.check_object_permissions(self.request, message)
+        return message
 
     @action(detail='pk', methods=['post'])
     def mark_read(self, request, pk=None):
@@ -275,7 +244,7 @@ class MessageViewSet(viewsets.ModelViewSet):
         user_id = request.data.get('user_id')
         user = get_object_or_404(User, id=user_id)
 
-        receipt = DeliveryReceipt.objects.filter(message=message, recipient=user).first()
+        receipt = message.receipts.filter(recipient=user).first()
         if receipt:
             receipt.delivered = True
             receipt.delivered_at = timezone.now()
@@ -287,12 +256,24 @@ class MessageViewSet(viewsets.ModelViewSet):
 
 
 class FileUploadViewSet(viewsets.ViewSet):
+    def initialize_request(self, request, *args, **kwargs):
+        drf_request = super().initialize_request(request, *args, **kwargs)
+        if self.action == 'upload':
+            request.upload_handlers = [HashingUploadHandler(request)]
+        return drf_request
+
     @action(detail=False, methods=['post'])
     def upload(self, request):
-        if 'file' not in request.FILES:
+        # Parsing the body runs HashingUploadHandler, which records rejections
+        files = request.FILES
+        rejection = getattr(request._request, 'upload_rejection', None)
+        if rejection:
+            return Response({'error': rejection[0]}, status=rejection[1])
+
+        if 'file' not in files:
             return Response({'error': 'No file provided'}, status=status.HTTP_400_BAD_REQUEST)
 
-        file_obj = request.FILES['file']
+        file_obj = files['file']
         conversation_id = request.data.get('conversation_id')
         sender_id = request.data.get('sender_id')
 
@@ -303,45 +284,50 @@ class FileUploadViewSet(viewsets.ViewSet):
             return Response({'error': 'sender_id is required'}, status=status.HTTP_400_BAD_REQUEST)
 
         # Validate file extension
-        dangerous_extensions = ['exe', 'bat', 'cmd', 'com', 'scr', 'vbs', 'js', 'jar', 'zip']
         file_ext = file_obj.name.lower().split('.')[-1]
-        if file_ext in dangerous_extensions:
+        if file_ext in DANGEROUS_EXTENSIONS:
             return Response({'error': f'File type .{file_ext} is not allowed'}, status=status.HTTP_400_BAD_REQUEST)
 
-        MAX_FILE_SIZE = 1024 * 1024 * 1024
         if file_obj.size > MAX_FILE_SIZE:
             return Response({'error': f'File size exceeds {MAX_FILE_SIZE / (1024**3):.1f}GB limit'}, 
                           status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
 
         try:
-            # Validate conversation exists
-            try:
-                conversation = Conversation.objects.get(id=conversation_id)
-            except Conversation.DoesNotExist:
+            # Validate conversation and sender exist, from the membership cache
+            members = conversation_members(conversation_id)
+            if members is None:
                 return Response({'error': f'Conversation not found: {conversation_id}'}, status=status.HTTP_404_NOT_FOUND)
-
-            # Validate sender exists
-            try:
-                sender = User.objects.get(id=sender_id)
-            except User.DoesNotExist:
+            sender = cached_user(sender_id)
+            if sender is None:
                 return Response({'error': f'User not found: {sender_id}'}, status=status.HTTP_404_NOT_FOUND)
-
-            # Calculate hash and reset file position after hashing
-            file_hash = hashlib.sha256()
-            file_obj.seek(0)  # Reset to beginning
-            for chunk in file_obj.chunks():
-                file_hash.update(chunk)
-            file_obj.seek(0)  # Reset again before saving
-
-            file_name = f"uploads/{conversation_id}/{file_hash.hexdigest()}_{file_obj.name}"
-            file_path = default_storage.save(file_name, file_obj)
-
-            # Ensure sender is a participant
-            if not Participant.objects.filter(conversation=conversation, user=sender).exists():
-                Participant.objects.create(conversation=conversation, user=sender)
+            conversation_id = parse_id(conversation_id)
+
+            quota_message = quota_error(sender.id, conversation_id, file_obj.size)
+            if quota_message:
+                return Response({'error': quota_message}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+            # HashingUploadHandler hashed the body while it was received
+            file_hash = getattr(file_obj, 'sha256', None)
+            if file_hash is None:
+                sha256 = hashlib.sha256()
+                for chunk in file_obj.chunks():
+                    sha256.update(chunk)
+                file_obj.seek(0)
+                file_hash = sha256.hexdigest()
+
+            # Reuse the stored copy when this conversation already has the same content
+            file_path = FileMessage.objects.using(shard_for(conversation_id)).filter(
+                hash=file_hash, message__conversation_id=conversation_id
+            ).values_list('storage_path', flat=True).first()
+            if not file_path or not default_storage.exists(file_path):
+                # The spooled temp file is renamed into MEDIA_ROOT rather than copied
+                file_name = f"uploads/{conversation_id}/{file_hash}_{file_obj.name}"
+                file_path = default_storage.save(file_name, file_obj)
+
+            members = ensure_member(conversation_id, sender, members)
 
             message = Message.objects.create(
-                conversation=conversation,
+                conversation_id=conversation_id,
                 sender=sender,
                 content=file_obj.name,
                 content_type=self._get_content_type(file_obj.name)
@@ -352,12 +338,11 @@ class FileUploadViewSet(viewsets.ViewSet):
                 storage_path=file_path,
                 mime_type=file_obj.content_type,
                 size_bytes=file_obj.size,
-                hash=file_hash.hexdigest()
+                hash=file_hash
             )
 
             # Create delivery receipts for other participants
-            for participant in conversation.participant_set.exclude(user=sender):
-                DeliveryReceipt.objects.create(message=message, recipient=participant.user)
+            create_receipts(message, members)
 
             return Response(MessageSerializer(message).data, status=status.HTTP_201_CREATED)
 
@@ -381,29 +366,105 @@ class FileUploadViewSet(viewsets.ViewSet):
             return 'file'
         return 'file'
 
-    @action(detail=False, methods=['get'])
-    def download(self, request):
-        import base64
-        
-        file_id = request.query_params.get('file_id')
-        file_msg = get_object_or_404(FileMessage, id=file_id)
 
-        file_path = file_msg.storage_path
-        if default_storage.exists(file_path):
+class SyncViewSet(viewsets.ViewSet):
+    def create(self, request):
+        user = get_object_or_404(User, id=request.data.get('user_id'))
+        sync_token = request.data.get('sync_token')
+
+        since = None
+        full_resync = False
+        if sync_token:
             try:
-                with default_storage.open(file_path, 'rb') as f:
-                    file_content = f.read()
-                
-                # Encode to base64 for safe JSON transmission
-                file_base64 = base64.b64encode(file_content).decode('utf-8')
-                
-                return Response({
-                    'file': file_base64,
-                    'filename': file_msg.message.content,
-                    'mime_type': file_msg.mime_type,
-                    'size': len(file_content)
-                })
-            except Exception as e:
-                return Response({'error': f'Error reading file: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        return Response({'error': 'File not found'}, status=status.HTTP_404_NOT_FOUND)
+                since = datetime.fromtimestamp(
+                    signing.loads(sync_token, salt=SYNC_TOKEN_SALT, max_age=settings.SYNC_TOKEN_MAX_AGE), tz=dt_timezone.utc
+                )
+            except signing.SignatureExpired:
+                # Tombstones this old may have been pruned, so deltas could miss deletions
+                full_resync = True
+            except (signing.BadSignature, TypeError, ValueError):
+                return Response({'error': 'Invalid sync_token'}, status=status.HTTP_400_BAD_REQUEST)
+
+        # Polling counts as activity, so clients no longer call track_activity on a timer
+        now = timezone.now()
+        mark_active(user, now)
+
+        data = {
+            'messages': [],
+            'removed_messages': [],
+            'receipts': [],
+            'memberships': [],
+            'presence': [],
+            'sync_token': signing.dumps(now.timestamp(), salt=SYNC_TOKEN_SALT),
+            'full_resync': full_resync,
+        }
+        # Without a token the client is starting fresh, and with an expired one
+        # it must start over: it loads full state through by_user and
+        # list_users and only needs a starting point.
+        if since is None:
+            return Response(data)
+
+        since -= SYNC_OVERLAP
+        conversation_ids = user_conversation_ids(user.id)
+
+        # Messages and receipts are read only from the shards holding the
+        # user's conversations
+        messages, removed, receipts = [], [], []
+        for alias, ids in group_by_shard(conversation_ids).items():
+            messages += Message.objects.using(alias).filter(
+                conversation_id__in=ids
+            ).filter(
+                Q(sent_at__gt=since) | Q(edited_at__gt=since)
+            ).filter(
+                Q(expires_at__isnull=True) | Q(expires_at__gt=now)
+            ).select_related('file').prefetch_related('sender')
+            removed += Message.objects.using(alias).filter(
+                conversation_id__in=ids, expires_at__gt=since, expires_at__lte=now
+            ).values_list('id', flat=True)
+            receipts += DeliveryReceipt.objects.using(alias).filter(
+                message__conversation_id__in=ids, updated_at__gt=since
+            ).filter(
+                Q(recipient=user) | Q(message__sender=user)
+            )
+        removed += MessageDeletion.objects.filter(
+            conversation_id__in=conversation_ids, deleted_at__gt=since
+        ).values_list('message_id', flat=True)
+        memberships = MembershipEvent.objects.filter(created_at__gt=since).filter(
+            Q(conversation_id__in=conversation_ids) | Q(user_id=user.id)
+        ).order_by('created_at')
+        presence = User.objects.filter(presence_changes(since, now)).exclude(id=user.id).order_by('-last_activity')
+
+        data['messages'] = MessageSerializer(messages, many=True).data
+        data['removed_messages'] = removed
+        data['receipts'] = DeliveryReceiptSerializer(receipts, many=True).data
+        data['memberships'] = MembershipEventSerializer(memberships, many=True).data
+        data['presence'] = UserSerializer(presence, many=True).data
+        return Response(data)
+
+
+class MetricsViewSet(viewsets.ViewSet):
+    def list(self, request):
+        return Response({
+            'rate_limits': counters(),
+            # Admission control is per process; this is the worker that answered
+            'worker_pid': os.getpid(),
+            'worker_in_flight': AdmissionControlMiddleware.in_flight,
+        })
+
+
+class ProfileViewSet(viewsets.ViewSet):
+    # Profiles show code paths and timings, so reading them needs the same
+    # X-Profile token that triggers them.
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if not valid_token(request.headers.get('X-Profile')):
+            raise PermissionDenied('A valid X-Profile token is required')
+
+    def list(self, request):
+        return Response(list_profiles())
+
+    def retrieve(self, request, pk=None):
+        path = profile_path(pk)
+        if path is None:
+            raise Http404
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{pk}.folded', content_type='text/plain')
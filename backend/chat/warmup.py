@@ -0,0 +1,42 @@
+from django.core.cache import cache
+from django.db import connections
+from django.template.loader import get_template
+from django.urls import get_resolver
+from rest_framework.settings import api_settings
+import time
+
+
+def warm_up(connect=True):
+    # Pays the one-off costs of the first request ahead of time: URL resolver
+    # tables, template compilation, lazily imported DRF classes and, with
+    # connect, the database and cache connections.
+    start = time.perf_counter()
+    timings = {}
+
+    resolver = get_resolver()
+    resolver.resolve('/api/users/')
+    resolver.reverse_dict
+    timings['urls'] = time.perf_counter()
+
+    get_template('index.html')
+    timings['templates'] = time.perf_counter()
+
+    for name in ('DEFAULT_RENDERER_CLASSES', 'DEFAULT_PARSER_CLASSES', 'DEFAULT_THROTTLE_CLASSES',
+                 'DEFAULT_PAGINATION_CLASS', 'DEFAULT_AUTHENTICATION_CLASSES'):
+        getattr(api_settings, name)
+    timings['rest_framework'] = time.perf_counter()
+
+    if connect:
+        for connection in connections.all():
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT 1')
+        timings['database'] = time.perf_counter()
+
+        cache.get('warm-up')
+        timings['cache'] = time.perf_counter()
+
+    # Convert finish times to per-step durations in milliseconds
+    previous = start
+    for step, finished in timings.items():
+        timings[step], previous = (finished - previous) * 1000, finished
+    return timings
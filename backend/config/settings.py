@@ -23,6 +23,9 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'chat.middleware.AdmissionControlMiddleware',
+    'chat.middleware.CompressionMiddleware',
+    'chat.middleware.ProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -54,10 +57,11 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'config.wsgi.application'
+ASGI_APPLICATION = 'config.asgi.application'
 
 if os.getenv('DATABASE_URL'):
     import dj_database_url
-    DATABASES = {'default': dj_database_url.config(default=os.getenv('DATABASE_URL'), conn_max_age=600)}
+    DATABASES = {'default': dj_database_url.config(default=os.getenv('DATABASE_URL'), conn_max_age=int(os.getenv('CONN_MAX_AGE', '600')))}
 else:
     DATABASES = {
         'default': {
@@ -66,6 +70,30 @@ else:
         }
     }
 
+# Conversations (with their participants, messages, files and receipts) are
+# spread over CHAT_SHARDS by chat.routers.ShardRouter; users and everything
+# else stay on "default", which is also the first shard.
+CHAT_SHARDS = ['default']
+if os.getenv('SHARD_DATABASE_URLS'):
+    import dj_database_url
+    for i, url in enumerate(os.getenv('SHARD_DATABASE_URLS').split(','), start=1):
+        DATABASES[f'shard_{i}'] = dj_database_url.parse(url.strip(), conn_max_age=int(os.getenv('CONN_MAX_AGE', '600')))
+        CHAT_SHARDS.append(f'shard_{i}')
+else:
+    # Local stand-in for trying sharding: SQLITE_SHARDS=3 gives default + 2 files
+    for i in range(1, int(os.getenv('SQLITE_SHARDS', '1'))):
+        DATABASES[f'shard_{i}'] = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': BASE_DIR / f'db_shard_{i}.sqlite3'}
+        CHAT_SHARDS.append(f'shard_{i}')
+DATABASE_ROUTERS = ['chat.routers.ShardRouter']
+
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('REDIS_URL'),
+        }
+    }
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -87,6 +115,11 @@ if not DEBUG:
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Upload quotas in bytes, checked against chat.storage_usage counters; 0 disables
+USER_STORAGE_QUOTA_BYTES = int(os.getenv('USER_STORAGE_QUOTA_BYTES', str(5 * 1024**3)))
+CONVERSATION_STORAGE_QUOTA_BYTES = int(os.getenv('CONVERSATION_STORAGE_QUOTA_BYTES', str(20 * 1024**3)))
+# Same filesystem as MEDIA_ROOT so uploads are moved into storage with a rename
+FILE_UPLOAD_TEMP_DIR = os.getenv('FILE_UPLOAD_TEMP_DIR', str(BASE_DIR / 'media' / 'tmp'))
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -97,7 +130,63 @@ CORS_ALLOW_ALL_ORIGINS = False
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 100,
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'chat.renderers.MessagePackRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+        'chat.renderers.MessagePackParser',
+    ],
+    'DEFAULT_THROTTLE_CLASSES': ['chat.throttling.ActionRateThrottle'],
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', '0')) or None,
+}
+
+# Token buckets per <router basename>.<action>, refilled at the given rate and
+# holding at most one period's worth of requests. Kept in the default cache, so
+# set REDIS_URL for the limits to hold across gunicorn workers.
+CHAT_RATE_LIMITS = {
+    'message.send': {'user': '60/min', 'ip': '300/min'},
+    'file.upload': {'user': '10/min', 'ip': '30/min'},
+    'user.track_activity': {'user': '12/min', 'ip': '120/min'},
+    'user.signup': {'ip': '10/min'},
+    'conversation.create_group': {'user': '10/min', 'ip': '30/min'},
+    'conversation.get_or_create': {'user': '30/min', 'ip': '120/min'},
+    'conversation.export': {'ip': '10/min'},
+    'sync.create': {'user': '30/min', 'ip': '300/min'},
 }
 
+# chat.membership: member sets and sender fields cached in the default cache,
+# with a per-process copy that may miss another worker's invalidation for
+# MEMBERSHIP_CACHE_LOCAL_TTL seconds. Without Redis the default cache is
+# per-process too and invalidations would not reach other workers, so only
+# the short-lived copy is used.
+MEMBERSHIP_CACHE_SHARED = bool(os.getenv('REDIS_URL'))
+MEMBERSHIP_CACHE_TIMEOUT = int(os.getenv('MEMBERSHIP_CACHE_TIMEOUT', '300'))
+MEMBERSHIP_CACHE_LOCAL_TTL = float(os.getenv('MEMBERSHIP_CACHE_LOCAL_TTL', '5'))
+
+# Counted in each worker process, not across the deployment; the total is
+# this times the number of workers.
+MAX_CONCURRENT_REQUESTS_PER_WORKER = int(os.getenv('MAX_CONCURRENT_REQUESTS_PER_WORKER', '200'))
+
+# Sync tokens older than this get a full resync instead of deltas, and
+# purge_expired deletes the tombstones and membership events behind them.
+SYNC_TOKEN_MAX_AGE = int(os.getenv('SYNC_TOKEN_MAX_AGE', str(7 * 24 * 3600)))
+
+# Request profiling: requests with a valid X-Profile token, or this fraction of
+# all requests, get their view sampled every PROFILE_INTERVAL_MS. The newest
+# PROFILE_MAX_FILES profiles are kept in PROFILE_DIR.
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '2'))
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '100'))
+PROFILE_TOKEN_MAX_AGE = int(os.getenv('PROFILE_TOKEN_MAX_AGE', str(24 * 3600)))
+PROFILE_DIR = os.getenv('PROFILE_DIR', str(BASE_DIR / 'profiles'))
+
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', '5'))
+
 FILE_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024 * 1024
 DATA_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024 * 1024
@@ -0,0 +1,28 @@
+import os
+
+# Import Django, DRF and the URLconf once in the master so forked workers start
+# ready to serve instead of each paying for the imports after a wake-up.
+preload_app = True
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv('WEB_CONCURRENCY', '2'))
+worker_class = 'uvicorn.workers.UvicornWorker'
+
+
+def when_ready(server):
+    # Runs in the master after preloading and before any worker is forked, so
+    # the URLconf and templates are loaded once and shared copy-on-write.
+    from chat.warmup import warm_up
+    warm_up(connect=False)
+
+
+def post_fork(server, worker):
+    # Workers must not share a database socket opened in the master
+    from django.db import connections
+    connections.close_all()
+
+
+def post_worker_init(worker):
+    from chat.warmup import warm_up
+    timings = warm_up()
+    worker.log.info('Warm-up took %.1f ms (%s)', sum(timings.values()),
+                    ', '.join(f'{step} {ms:.1f} ms' for step, ms in timings.items()))
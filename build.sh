@@ -6,5 +6,6 @@ pip install -r requirements.txt
 cd backend
 python manage.py collectstatic --noinput
 python manage.py migrate
+python manage.py profile_startup --budget-ms "${COLD_START_BUDGET_MS:-5000}"
 
 cd ..
@@ -9,6 +9,8 @@ class App {
         this.activityInterval = null;
         this.messageRefreshInterval = null;
         this.lastMessageCount = 0;
+        this.syncToken = null;
+        this.lastActivityPing = 0;
 
         this.loadCurrentUser();
         this.setupEventListeners();
@@ -26,8 +28,12 @@ class App {
 
     init() {
         this.render();
-        this.loadConversations();
-        this.loadUsers();
+        this.syncToken = null;
+        // Take a sync token before the full load so later deltas cover anything that changes in between
+        this.syncState().finally(() => {
+            this.loadConversations();
+            this.loadUsers();
+        });
         this.startActivityTracking();
     }
 
@@ -36,13 +42,10 @@ class App {
 
         this.trackActivity();
 
-        // Reduce frequency from 3s to 10s for less server load, but track interactions immediately
+        // One sync request per cycle returns new messages, receipts, membership and presence changes
         this.activityInterval = setInterval(() => {
-            this.trackActivity();
-            this.refreshUserStatus();
-            this.loadConversations();
-            this.refreshMessages();
-        }, 10000); // Increased from 3000ms to 10000ms
+            this.syncState();
+        }, 10000);
 
         document.addEventListener('mousemove', () => this.trackActivity(), { passive: true });
         document.addEventListener('keypress', () => this.trackActivity(), { passive: true });
@@ -50,6 +53,10 @@ class App {
 
     async trackActivity() {
         if (!this.currentUser) return;
+        // mousemove fires continuously; the server only needs one ping per interval
+        const now = Date.now();
+        if (now - this.lastActivityPing < 10000) return;
+        this.lastActivityPing = now;
         try {
             await fetch(`${this.apiBase}/users/track_activity/`, {
                 method: 'POST',
@@ -61,6 +68,89 @@ class App {
         }
     }
 
+    async syncState() {
+        if (!this.currentUser) return;
+        try {
+            const response = await fetch(`${this.apiBase}/sync/`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ user_id: this.currentUser.id, sync_token: this.syncToken })
+            });
+            if (!response.ok) {
+                console.error('Sync error:', response.status, response.statusText);
+                if (response.status === 400) this.syncToken = null;
+                return;
+            }
+            const data = await response.json();
+            this.syncToken = data.sync_token;
+            if (data.full_resync) {
+                // The old token outlived the server's sync history
+                this.loadConversations();
+                this.loadUsers();
+                return;
+            }
+
+            data.presence.forEach(user => this.upsertById(this.users, user));
+            this.users.sort((a, b) => new Date(b.last_activity) - new Date(a.last_activity));
+
+            let unknownConversation = false;
+            let currentChanged = false;
+            data.messages.forEach(msg => {
+                const conv = this.conversations.find(c => c.id === msg.conversation);
+                if (conv) {
+                    this.upsertById(conv.messages, msg);
+                } else {
+                    unknownConversation = true;
+                }
+                if (this.currentConversation && this.currentConversation.id === msg.conversation) {
+                    this.upsertById(this.currentConversation.messages, msg);
+                    currentChanged = true;
+                }
+            });
+
+            // Expired or deleted since the last token
+            const removed = new Set(data.removed_messages);
+            if (removed.size > 0) {
+                this.conversations.forEach(conv => {
+                    conv.messages = conv.messages.filter(msg => !removed.has(msg.id));
+                });
+                if (this.currentConversation) {
+                    const count = this.currentConversation.messages.length;
+                    this.currentConversation.messages = this.currentConversation.messages.filter(msg => !removed.has(msg.id));
+                    currentChanged = currentChanged || this.currentConversation.messages.length !== count;
+                }
+            }
+
+            if (unknownConversation || data.memberships.length > 0) {
+                await this.loadConversations();
+            } else if (data.messages.length > 0 || removed.size > 0) {
+                this.renderChatList();
+            }
+
+            if (currentChanged) {
+                this.renderMessages();
+                this.lastMessageCount = this.currentConversation.messages.length;
+                const container = document.getElementById('messages-container');
+                if (container) {
+                    setTimeout(() => {
+                        container.scrollTop = container.scrollHeight;
+                    }, 0);
+                }
+            }
+        } catch (e) {
+            console.error('Error syncing:', e);
+        }
+    }
+
+    upsertById(list, item) {
+        const index = list.findIndex(existing => existing.id === item.id);
+        if (index === -1) {
+            list.push(item);
+        } else {
+            list[index] = item;
+        }
+    }
+
     async refreshUserStatus() {
         await this.loadUsers();
     }
@@ -438,7 +528,8 @@ class App {
             formData.append('conversation_id', this.currentConversation.id);
             formData.append('sender_id', this.currentUser.id);
 
-            const response = await fetch(`${this.apiBase}/files/upload/`, {
+            // sender_id is repeated in the URL so the rate limit applies before the body is read
+            const response = await fetch(`${this.apiBase}/files/upload/?sender_id=${this.currentUser.id}`, {
                 method: 'POST',
                 body: formData
             });
@@ -464,25 +555,15 @@ class App {
                 return;
             }
 
-            const data = await response.json();
-            if (!data.file) {
-                alert('No file data received');
-                return;
-            }
-
-            // Decode base64 to binary
-            const binaryString = atob(data.file);
-            const bytes = new Uint8Array(binaryString.length);
-            for (let i = 0; i < binaryString.length; i++) {
-                bytes[i] = binaryString.charCodeAt(i);
-            }
-
-            // Create blob with correct MIME type
-            const blob = new Blob([bytes], { type: data.mime_type || 'application/octet-stream' });
+            // The file is streamed as-is; the name comes from Content-Disposition
+            const blob = await response.blob();
+            const disposition = response.headers.get('Content-Disposition') || '';
+            const match = disposition.match(/filename\*=utf-8''([^;]+)|filename="([^"]+)"/i);
+            const filename = match ? (match[1] ? decodeURIComponent(match[1]) : match[2]) : 'download';
             const url = window.URL.createObjectURL(blob);
             const a = document.createElement('a');
             a.href = url;
-            a.download = data.filename || 'download';
+            a.download = filename;
             document.body.appendChild(a);
             a.click();
 
@@ -704,7 +785,8 @@ class App {
                     userDiv.onmouseover = () => userDiv.style.backgroundColor = '#efefef';
                     userDiv.onmouseout = () => userDiv.style.backgroundColor = '#f5f5f5';
 
-                    const offlineTime = this.formatOfflineTime(user.offline_minutes);
+                    // Sync only reports presence changes, so the server's offline_minutes goes stale
+                    const offlineTime = this.formatOfflineTime(this.offlineDuration(user.last_activity));
 
                     userDiv.innerHTML = `
                         <button class="start-chat-btn" data-user-id="${user.id}" style="flex: 1; background: none; border: none; text-align: left; cursor: pointer; font-size: 14px; padding: 0; margin: 0;">
@@ -886,6 +968,16 @@ class App {
         return Math.round((bytes / Math.pow(k, i)) * 100) / 100 + ' ' + sizes[i];
     }
 
+    offlineDuration(lastActivity) {
+        // Same format as UserSerializer.offline_minutes
+        const total = Math.max(0, Math.floor((Date.now() - new Date(lastActivity)) / 1000));
+        const minutes = Math.floor(total / 60);
+        const seconds = total % 60;
+        if (minutes === 0) return `${seconds}s`;
+        if (minutes < 60) return `${minutes}m ${seconds}s`;
+        return `${Math.floor(minutes / 60)}h ${minutes % 60}m ${seconds}s`;
+    }
+
     formatOfflineTime(offlineString) {
         // offlineString is already in format like "5m 32s" or "2h 15m"
         if (!offlineString) return '';